@@ -0,0 +1,54 @@
+import os
+import asyncio
+import functools
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Optional, TypeVar
+
+T = TypeVar('T')
+
+# Threads available to blocking calls awaited from the event loop (ytmusicapi,
+# database and token refreshes); each holds a thread until it returns.
+IO_WORKERS = int(os.getenv('SYNCTUNES_IO_WORKERS', '64'))
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """Return the process-wide event loop, starting its thread on first use.
+
+    Every request thread submits its coroutines here, so scheduling,
+    timeouts and concurrency limits for all requests live on one loop.
+    Spotify calls are multiplexed on its sockets through httpx (see
+    SpotifyClient.request_async); ytmusicapi is blocking, so each of its
+    calls occupies an executor thread and at most IO_WORKERS run at once.
+    """
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                loop.set_default_executor(ThreadPoolExecutor(IO_WORKERS, thread_name_prefix='synctunes-io'))
+                threading.Thread(target=loop.run_forever, name='synctunes-loop', daemon=True).start()
+                _loop = loop
+    return _loop
+
+def run_sync(coro: Awaitable[T], timeout: Optional[float] = None) -> T:
+    """Run a coroutine on the shared loop from synchronous code and return its result"""
+    loop = get_event_loop()
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        raise RuntimeError("run_sync() called from the event loop thread; await the coroutine instead")
+    return asyncio.run_coroutine_threadsafe(coro, loop).result(timeout)
+
+async def to_thread(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Await a blocking call on the shared I/O executor, which holds a thread until it returns"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(fn, *args, **kwargs))
+
+def run_in_background(fn: Callable[..., T], *args: Any, **kwargs: Any) -> 'Future[T]':
+    """Start a blocking call on the shared I/O executor without waiting for it"""
+    return asyncio.run_coroutine_threadsafe(to_thread(fn, *args, **kwargs), get_event_loop())
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+Benchmark YouTube Music matching: wall-clock time of sync_to_youtube_music
+against a stub client with fixed search latency, at several parallelism levels
+"""
+import os
+import sys
+import time
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import ytmusic_pool
+import youtube_music
+
+class StubYTMusic:
+    """Answers every search after a fixed delay, like a remote round trip"""
+    latency = 0.05
+
+    def search(self, query, filter=None, limit=20):
+        time.sleep(self.latency)
+        return [{'videoId': f'v{abs(hash(query))}', 'title': query, 'artists': [{'name': 'Artist'}],
+                 'album': {'name': 'Album'}, 'duration_seconds': 200}]
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    songs = [{'name': f'Track {i}', 'artists': [f'Artist {i % 40}'], 'album': f'Album {i % 90}',
+              'duration_ms': 200000} for i in range(count)]
+
+    print(f"{count} songs, {StubYTMusic.latency * 1000:.0f} ms per search")
+    for parallelism in (1, 4, 8, 16, 32):
+        ytmusic_pool._pool = ytmusic_pool.YTMusicPool(size=parallelism, factory=StubYTMusic)
+        # Every level searches every song, not the previous level's cached matches
+        youtube_music.match_cache.memory.clear()
+        start = time.perf_counter()
+        result = youtube_music.sync_to_youtube_music(songs, parallelism=parallelism)
+        elapsed = time.perf_counter() - start
+        assert [found['original'] for found in result['found_songs']] == songs
+        print(f"parallelism {parallelism:3}: {elapsed:6.2f}s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Benchmark per-row memory of the Song catalog: the original layout (a list
+of row dicts plus dict key maps) against dict rows and array-backed columns
+"""
+import os
+import sys
+import gc
+import time
+import tracemalloc
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from database import InMemoryDatabase
+
+def song_rows(count: int):
+    """Yield rows shaped like the ones a sync stores, with fresh strings per row"""
+    for i in range(count):
+        yield {
+            'title': f'Track {i}',
+            'artist': f'Artist {i % 50000}',
+            'album': f'Album {i % 200000}',
+            'duration': 180 + i % 120
+        }
+
+def original_layout(count: int):
+    """Rows as dicts with song_id and unique key maps holding row references"""
+    rows, by_id, by_key = [], {}, {}
+    for song_id, row in enumerate(song_rows(count), 1):
+        row['song_id'] = song_id
+        rows.append(row)
+        by_id[song_id] = row
+        by_key[(row['title'], row['artist'], row['album'])] = row
+    return rows, by_id, by_key
+
+def measure(label: str, build, count: int) -> None:
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    kept = build(count)
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    print(f"{label:<16} {current / 2**20:8.1f} MiB  {current / count:6.0f} B/row  "
+          f"(insert {elapsed:.1f}s, rows and indexes)")
+
+def database(**options):
+    def build(count: int) -> InMemoryDatabase:
+        db = InMemoryDatabase(**options)
+        db.insert_many('Song', list(song_rows(count)))
+        return db
+    return build
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    measure('original', original_layout, count)
+    measure('dict rows', database(compact_tables={}), count)
+    measure('columns', database(), count)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Benchmark playlist track payloads with and without the Spotify `fields` filter:
+bytes on the wire, JSON decode time and peak memory of get_playlist_tracks
+"""
+import os
+import sys
+import json
+import time
+import socket
+import subprocess
+import tracemalloc
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from rate_limiter import RateLimiter
+from spotify_client import SpotifyClient
+import spotify_client
+import spotify_auth
+
+def record_pages(client: SpotifyClient, url: str, count: int, fields: str) -> list:
+    """Fetch every page of the playlist once and keep the raw response bodies"""
+    bodies = []
+    for offset in range(0, count, 100):
+        params = {'limit': 100, 'offset': offset}
+        if fields:
+            params['fields'] = fields
+        response = client.get(url, 'token', params=params)
+        response.raise_for_status()
+        bodies.append(response.content)
+    return bodies
+
+def measure(api_url: str, client: SpotifyClient, count: int, fields: str) -> dict:
+    url = f"{api_url}/playlists/bench/tracks"
+    bodies = record_pages(client, url, count, fields)
+
+    start = time.perf_counter()
+    for body in bodies:
+        spotify_auth._normalize_tracks(json.loads(body))
+    decode = time.perf_counter() - start
+
+    spotify_auth.TRACK_FIELDS = fields
+    spotify_auth.track_cache.clear()
+    tracemalloc.start()
+    start = time.perf_counter()
+    tracks = spotify_auth.get_playlist_tracks('token', 'bench', snapshot_id=f'{fields}')
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert len(tracks) == count
+
+    return {'bytes': sum(len(body) for body in bodies), 'decode': decode, 'fetch': elapsed, 'peak': peak}
+
+def start_fake(count: int) -> tuple:
+    """Run the fake API in its own process so its allocations stay out of the measurements"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_spotify.py')
+    process = subprocess.Popen([sys.executable, script, str(port), '', str(count)], stdout=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.1).close()
+            break
+        except OSError:
+            time.sleep(0.05)
+    return process, f'http://127.0.0.1:{port}/v1'
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    process, api_url = start_fake(count)
+    spotify_auth.SPOTIFY_API_URL = api_url
+    client = SpotifyClient(limiter=RateLimiter(10000))
+    spotify_client._client = client
+    fields = spotify_auth.TRACK_FIELDS
+
+    try:
+        full = measure(api_url, client, count, '')
+        trimmed = measure(api_url, client, count, fields)
+        print(f"{count} tracks, {(count + 99) // 100} pages")
+        for name, key, unit, scale in (('Payload', 'bytes', 'MB', 1e6), ('Decode', 'decode', 's', 1),
+                                       ('Fetch', 'fetch', 's', 1), ('Peak memory', 'peak', 'MB', 1e6)):
+            print(f"{name:12} full {full[key] / scale:8.2f}{unit}  trimmed {trimmed[key] / scale:8.2f}{unit}  "
+                  f"({trimmed[key] / full[key]:.0%})")
+    finally:
+        client.close()
+        process.terminate()
+        process.wait()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Benchmark the Spotify request scheduler against a throttling fake API:
+one user's large sync next to several small ones
+"""
+import os
+import sys
+import time
+import threading
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from fake_spotify import FakeSpotify
+from rate_limiter import RateLimiter
+from spotify_client import SpotifyClient
+
+def run_user(client: SpotifyClient, url: str, token: str, count: int, latencies: list):
+    for _ in range(count):
+        start = time.perf_counter()
+        response = client.get(f"{url}/search", token, params={'q': 'x', 'type': 'track', 'limit': 1})
+        latencies.append((time.perf_counter() - start, response.status_code))
+
+def main():
+    server_rate = float(sys.argv[1]) if len(sys.argv) > 1 else 40
+    client_rate = float(sys.argv[2]) if len(sys.argv) > 2 else 60
+    fake = FakeSpotify(rate_limit=server_rate, retry_after=1).start()
+    client = SpotifyClient(limiter=RateLimiter(client_rate))
+
+    try:
+        heavy: list = []
+        light = {f'user{i}': [] for i in range(4)}
+        threads = [threading.Thread(target=run_user, args=(client, fake.url, 'heavy', 25, heavy))
+                   for _ in range(8)]
+        threads += [threading.Thread(target=run_user, args=(client, fake.url, token, 10, latencies))
+                    for token, latencies in light.items()]
+
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        print(f"Server budget {server_rate:.0f}/s, client ceiling {client_rate:.0f}/s, {elapsed:.2f}s total")
+        failed = sum(1 for _, status in heavy if status != 200)
+        print(f"heavy user: {len(heavy)} calls, mean {sum(t for t, _ in heavy) / len(heavy):.3f}s, {failed} failed")
+        for token, latencies in light.items():
+            failed = sum(1 for _, status in latencies if status != 200)
+            print(f"{token}: {len(latencies)} calls, mean {sum(t for t, _ in latencies) / len(latencies):.3f}s, "
+                  f"{failed} failed")
+        print(f"server: {fake.stats['requests']} requests, {fake.stats['throttled']} answered 429")
+        print(f"client: {client.metrics()}")
+    finally:
+        client.close()
+        fake.stop()
+
+if __name__ == '__main__':
+    main()
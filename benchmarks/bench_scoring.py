@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+"""
+Benchmark candidate scoring: time to score a playlist's worth of songs
+against their top search results in one batch
+"""
+import os
+import sys
+import time
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from match_scoring import pick_best
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    per_song = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    songs = [{'name': f'Track {i}', 'artists': [f'Artist {i % 40}'], 'album': f'Album {i % 90}',
+              'duration_ms': 200000} for i in range(count)]
+    # The real recording sits behind live/remix/other-artist decoys
+    candidates = []
+    for i, song in enumerate(songs):
+        group = [{'videoId': f'd{i}-{j}', 'title': f"Track {i} ({('Live', 'Remix', 'Cover')[j % 3]})",
+                  'artists': song['artists'], 'album': '', 'duration': 230} for j in range(per_song - 1)]
+        group.insert(i % per_song, {'videoId': f'v{i}', 'title': song['name'], 'artists': song['artists'],
+                                    'album': song['album'], 'duration': 201})
+        candidates.append(group)
+
+    start = time.perf_counter()
+    best = pick_best(songs, candidates)
+    elapsed = time.perf_counter() - start
+    correct = sum(1 for i, match in enumerate(best) if match and match['videoId'] == f'v{i}')
+    print(f"{count} songs x {per_song} candidates: {elapsed * 1000:.1f} ms, {correct}/{count} correct")
+
+if __name__ == '__main__':
+    main()
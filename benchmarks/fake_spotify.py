@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+Minimal local stand-in for the Spotify Web API, for benchmarks and manual testing.
+
+Point the app at it with SPOTIFY_API_URL=http://127.0.0.1:<port>/v1 and
+SPOTIFY_TOKEN_URL=http://127.0.0.1:<port>/api/token. It serves paginated
+playlists and playlist tracks, search, track adds and token refreshes,
+answers 401 for tokens in `expired_tokens`, and can enforce its own request
+budget with 429 + Retry-After responses.
+"""
+import re
+import sys
+import json
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from typing import Any, Dict, Optional
+
+def make_track(i: int) -> Dict[str, Any]:
+    """A full track object shaped like the real API's, markets and artwork included"""
+    return {
+        'type': 'track',
+        'id': f'track{i:07d}',
+        'uri': f'spotify:track:track{i:07d}',
+        'name': f'Track {i}',
+        'duration_ms': 150000 + (i * 7919) % 150000,
+        'explicit': False,
+        'popularity': i % 100,
+        'preview_url': f'https://p.scdn.co/mp3-preview/{i:040d}',
+        'available_markets': ['AD', 'AE', 'AR', 'AT', 'AU', 'BE', 'BG', 'BR', 'CA', 'CH', 'CL', 'CO',
+                              'DE', 'DK', 'ES', 'FI', 'FR', 'GB', 'HK', 'IE', 'IT', 'JP', 'MX', 'NL',
+                              'NO', 'NZ', 'PL', 'PT', 'SE', 'SG', 'TR', 'US', 'ZA'],
+        'external_ids': {'isrc': f'USRC1{i:07d}'},
+        'external_urls': {'spotify': f'https://open.spotify.com/track/track{i:07d}'},
+        'artists': [{
+            'id': f'artist{i % 5000:05d}',
+            'name': f'Artist {i % 5000}',
+            'type': 'artist',
+            'uri': f'spotify:artist:artist{i % 5000:05d}',
+            'external_urls': {'spotify': f'https://open.spotify.com/artist/artist{i % 5000:05d}'}
+        }],
+        'album': {
+            'id': f'album{i % 20000:06d}',
+            'name': f'Album {i % 20000}',
+            'album_type': 'album',
+            'release_date': '2020-01-01',
+            'total_tracks': 12,
+            'images': [{'url': f'https://i.scdn.co/image/{i % 20000:040d}{size}', 'height': size, 'width': size}
+                       for size in (640, 300, 64)],
+            'external_urls': {'spotify': f'https://open.spotify.com/album/album{i % 20000:06d}'}
+        }
+    }
+
+def parse_fields(spec: str) -> Dict[str, Any]:
+    """Parse a Spotify `fields` filter such as 'total,items(track(name,artists(name)))'"""
+    def parse(pos: int) -> tuple:
+        fields: Dict[str, Any] = {}
+        name = ''
+        while pos < len(spec):
+            char = spec[pos]
+            if char == '(':
+                fields[name], pos = parse(pos + 1)
+                name = ''
+            elif char == ')':
+                break
+            elif char == ',':
+                if name:
+                    fields[name] = None
+                name = ''
+            else:
+                name += char
+            pos += 1
+        if name:
+            fields[name] = None
+        return fields, pos
+
+    def expand(fields: Dict[str, Any]) -> Dict[str, Any]:
+        # 'tracks.total' is shorthand for 'tracks(total)'
+        expanded: Dict[str, Any] = {}
+        for name, sub in fields.items():
+            sub = expand(sub) if sub else sub
+            parts = name.split('.')
+            for part in reversed(parts[1:]):
+                sub = {part: sub}
+            if isinstance(expanded.get(parts[0]), dict) and isinstance(sub, dict):
+                expanded[parts[0]].update(sub)
+            else:
+                expanded[parts[0]] = sub
+        return expanded
+    return expand(parse(0)[0])
+
+def apply_fields(value: Any, fields: Optional[Dict[str, Any]]) -> Any:
+    """Keep only the requested fields, descending into lists and nested objects"""
+    if fields is None:
+        return value
+    if isinstance(value, list):
+        return [apply_fields(item, fields) for item in value]
+    if isinstance(value, dict):
+        return {key: apply_fields(value[key], sub) for key, sub in fields.items() if key in value}
+    return value
+
+class FakeSpotify:
+    """Threaded HTTP server holding the fake API's state"""
+
+    def __init__(self, port: int = 0, latency: float = 0.0, rate_limit: Optional[float] = None,
+                 retry_after: int = 1, playlist_size: int = 1000):
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.playlist_size = playlist_size
+        self.playlist_sizes: Dict[str, int] = {}
+        self.added: Dict[str, list] = {}
+        self.expired_tokens: set = set()
+        # Fail the next N track adds with 500, optionally after applying them
+        self.fail_adds = 0
+        self.fail_after_apply = False
+        self.issued_tokens = 0
+        self.stats = {'requests': 0, 'throttled': 0, 'unauthorized': 0, 'refreshes': 0, 'bytes': 0}
+        self._lock = threading.Lock()
+        self._window_start = time.monotonic()
+        self._window_count = 0
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self.server.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server.server_address[1]}/v1'
+
+    def start(self) -> 'FakeSpotify':
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _admit(self) -> bool:
+        """Apply the per-second request budget; False means answer 429"""
+        with self._lock:
+            self.stats['requests'] += 1
+            if self.rate_limit is None:
+                return True
+            now = time.monotonic()
+            if now - self._window_start >= 1:
+                self._window_start = now
+                self._window_count = 0
+            self._window_count += 1
+            if self._window_count > self.rate_limit:
+                self.stats['throttled'] += 1
+                return False
+            return True
+
+    def _page(self, base: str, items: list, total: int, offset: int, limit: int) -> Dict[str, Any]:
+        next_offset = offset + limit
+        return {
+            'href': f'{base}?offset={offset}&limit={limit}',
+            'items': items,
+            'limit': limit,
+            'offset': offset,
+            'total': total,
+            'next': f'{base}?offset={next_offset}&limit={limit}' if next_offset < total else None,
+            'previous': None
+        }
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status: int, payload: Any, headers: Optional[Dict[str, str]] = None):
+                body = json.dumps(payload).encode('utf-8')
+                with fake._lock:
+                    fake.stats['bytes'] += len(body)
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _start(self) -> bool:
+                if not fake._admit():
+                    self._send(429, {'error': {'status': 429, 'message': 'API rate limit exceeded'}},
+                               {'Retry-After': str(fake.retry_after)})
+                    return False
+                if fake.latency:
+                    time.sleep(fake.latency)
+                token = self.headers.get('Authorization', '').replace('Bearer ', '', 1)
+                if token in fake.expired_tokens:
+                    with fake._lock:
+                        fake.stats['unauthorized'] += 1
+                    self._send(401, {'error': {'status': 401, 'message': 'The access token expired'}})
+                    return False
+                return True
+
+            def do_GET(self):
+                if not self._start():
+                    return
+                parsed = urlparse(self.path)
+                query = parse_qs(parsed.query)
+                offset = int(query.get('offset', ['0'])[0])
+                limit = int(query.get('limit', ['20'])[0])
+                base = f'http://{self.headers["Host"]}{parsed.path}'
+
+                if parsed.path == '/v1/me':
+                    return self._send(200, {'id': 'fakeuser', 'display_name': 'Fake User'})
+                if parsed.path == '/v1/me/playlists':
+                    total = 120
+                    items = [{'id': f'playlist{i}', 'name': f'Playlist {i}', 'description': '',
+                              'snapshot_id': f'snap{i}', 'tracks': {'total': fake.playlist_size}}
+                             for i in range(offset, min(offset + limit, total))]
+                    return self._send(200, fake._page(base, items, total, offset, limit))
+                match = re.fullmatch(r'/v1/playlists/([^/]+)/tracks', parsed.path)
+                if match:
+                    total = fake.playlist_sizes.get(match.group(1), fake.playlist_size)
+                    items = [{'added_at': '2024-01-01T00:00:00Z', 'is_local': False, 'track': make_track(i)}
+                             for i in range(offset, min(offset + limit, total))]
+                    page = fake._page(base, items, total, offset, limit)
+                    if 'fields' in query:
+                        page = apply_fields(page, parse_fields(query['fields'][0]))
+                    return self._send(200, page)
+                match = re.fullmatch(r'/v1/playlists/([^/]+)', parsed.path)
+                if match:
+                    if match.group(1) in fake.added:
+                        total = len(fake.added[match.group(1)])
+                    else:
+                        total = fake.playlist_sizes.get(match.group(1), fake.playlist_size)
+                    playlist = {'id': match.group(1), 'snapshot_id': f'snap-{total}', 'tracks': {'total': total}}
+                    if 'fields' in query:
+                        playlist = apply_fields(playlist, parse_fields(query['fields'][0]))
+                    return self._send(200, playlist)
+                if parsed.path == '/v1/search':
+                    return self._send(200, {'tracks': fake._page(base, [make_track(1)], 1, 0, 1)})
+                self._send(404, {'error': {'status': 404, 'message': 'Not found'}})
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length)
+                if not self._start():
+                    return
+                parsed = urlparse(self.path)
+                if parsed.path == '/api/token':
+                    with fake._lock:
+                        fake.stats['refreshes'] += 1
+                        fake.issued_tokens += 1
+                        token = f'access{fake.issued_tokens}'
+                    return self._send(200, {'access_token': token, 'token_type': 'Bearer',
+                                            'expires_in': 3600, 'scope': ''})
+                match = re.fullmatch(r'/v1/playlists/([^/]+)/tracks', parsed.path)
+                if match:
+                    data = json.loads(body or b'{}')
+                    # Responses are sent after the lock is released; _send takes it too
+                    with fake._lock:
+                        failing = fake.fail_adds > 0
+                        if failing:
+                            fake.fail_adds -= 1
+                        tracks = fake.added.setdefault(match.group(1), [])
+                        position = data.get('position')
+                        out_of_bounds = position is not None and position > len(tracks)
+                        if not out_of_bounds and (not failing or fake.fail_after_apply):
+                            if position is None:
+                                tracks.extend(data.get('uris', []))
+                            else:
+                                tracks[position:position] = data.get('uris', [])
+                        snapshot = f'snap-{len(tracks)}'
+                    if out_of_bounds:
+                        return self._send(400, {'error': {'status': 400, 'message': 'Index out of bounds'}})
+                    if failing:
+                        return self._send(500, {'error': {'status': 500, 'message': 'Server error'}})
+                    return self._send(201, {'snapshot_id': snapshot})
+                match = re.fullmatch(r'/v1/users/([^/]+)/playlists', parsed.path)
+                if match:
+                    data = json.loads(body or b'{}')
+                    return self._send(201, {'id': 'newplaylist', 'name': data.get('name')})
+                self._send(404, {'error': {'status': 404, 'message': 'Not found'}})
+
+        return Handler
+
+def main():
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8765
+    rate_limit = float(sys.argv[2]) if len(sys.argv) > 2 and sys.argv[2] else None
+    playlist_size = int(sys.argv[3]) if len(sys.argv) > 3 else 1000
+    fake = FakeSpotify(port=port, rate_limit=rate_limit, playlist_size=playlist_size)
+    print(f"Fake Spotify API on {fake.url}")
+    fake.server.serve_forever()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Set
+from singleflight import SingleFlight
+
+class LRUCache:
+    """Thread-safe size-bounded LRU map with optional expiry.
+
+    Each entry costs sizeof(value) against max_size (1 per entry by
+    default); the least recently used entries are evicted once the total
+    goes over the limit. Entries given a ttl, or put while the cache has a
+    default ttl, read as missing once that many seconds have passed.
+    """
+
+    def __init__(self, max_size: int, sizeof: Optional[Callable[[Any], int]] = None,
+                 ttl: Optional[float] = None):
+        self.max_size = max_size
+        self.sizeof = sizeof or (lambda value: 1)
+        self.ttl = ttl
+        self.size = 0
+        self._entries: 'OrderedDict[Hashable, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0}
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] is not None and entry[2] <= time.monotonic():
+                del self._entries[key]
+                self.size -= entry[1]
+                self._stats['expired'] += 1
+                entry = None
+            if entry is None:
+                self._stats['misses'] += 1
+                return default
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        size = self.sizeof(value)
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            if size > self.max_size:
+                return
+            self._entries[key] = (value, size, expires)
+            self.size += size
+            while self.size > self.max_size:
+                _, (_, evicted, _) = self._entries.popitem(last=False)
+                self.size -= evicted
+                self._stats['evictions'] += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return default
+            self.size -= entry[1]
+            return entry[0]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def metrics(self) -> Dict[str, Any]:
+        """Hit/miss/eviction counters plus current entry count and size"""
+        with self._lock:
+            metrics: Dict[str, Any] = dict(self._stats)
+            metrics['entries'] = len(self._entries)
+            metrics['size'] = self.size
+            lookups = metrics['hits'] + metrics['misses']
+            metrics['hit_rate'] = metrics['hits'] / lookups if lookups else 0.0
+            return metrics
+
+class RefreshingCache:
+    """Stale-while-revalidate cache in front of a loader function.
+
+    A value younger than `ttl` seconds is served as is. An older one is
+    still served immediately, while one background refresh per key reloads
+    it; values older than `max_stale` are dropped and the next caller loads
+    them itself. Concurrent cold loads of a key share one loader call. A
+    failed refresh keeps the previous value.
+    """
+
+    def __init__(self, loader: Callable[[Hashable], Any], ttl: float, max_stale: float,
+                 max_entries: int = 1000, submit: Optional[Callable[..., Any]] = None):
+        self.loader = loader
+        self.ttl = ttl
+        self.entries = LRUCache(max_entries, ttl=max_stale)
+        self.submit = submit or (lambda fn, *args: threading.Thread(target=fn, args=args, daemon=True).start())
+        self._flights = SingleFlight()
+        self._refreshing: Set[Hashable] = set()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'stale_hits': 0, 'misses': 0, 'refreshes': 0, 'refresh_errors': 0}
+
+    def _count(self, stat: str) -> None:
+        with self._lock:
+            self._stats[stat] += 1
+
+    def _load(self, key: Hashable) -> Any:
+        value = self.loader(key)
+        self.entries.put(key, (value, time.monotonic()))
+        return value
+
+    def _refresh(self, key: Hashable) -> None:
+        try:
+            self._flights.do(key, lambda: self._load(key))
+            self._count('refreshes')
+        except Exception as e:
+            logging.warning(f"Background refresh of {key!r} failed: {e}")
+            self._count('refresh_errors')
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def get(self, key: Hashable) -> Any:
+        """The cached value for key, loading it only if nothing usable is cached"""
+        entry = self.entries.get(key)
+        if entry is None:
+            self._count('misses')
+            return self._flights.do(key, lambda: self._load(key))
+        value, loaded = entry
+        if time.monotonic() - loaded < self.ttl:
+            self._count('hits')
+            return value
+        with self._lock:
+            self._stats['stale_hits'] += 1
+            start = key not in self._refreshing
+            self._refreshing.add(key)
+        if start:
+            try:
+                self.submit(self._refresh, key)
+            except Exception as e:
+                logging.warning(f"Could not schedule refresh of {key!r}: {e}")
+                with self._lock:
+                    self._refreshing.discard(key)
+        return value
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            metrics: Dict[str, Any] = dict(self._stats)
+            metrics['refreshing'] = len(self._refreshing)
+        metrics['entries'] = len(self.entries)
+        return metrics
@@ -1,21 +1,209 @@
+from contextlib import contextmanager, ExitStack
 from datetime import datetime
+from functools import partial
+from itertools import islice
+from types import MappingProxyType
+import atexit
+import gc
+import logging
+import os
 import threading
-from typing import Dict, List, Optional, Any
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional, Any, Tuple
+from table_storage import ColumnTable, KeyIndex, RowTable
 
-# Thread-safe in-memory database implementation
-class InMemoryDatabase:
+# Auto-increment primary key of each table
+PRIMARY_KEYS = {
+    'User_': 'user_id',
+    'Admin': 'admin_id',
+    'Platform': 'platform_id',
+    'UserPlatformAccount': 'account_id',
+    'Playlist': 'playlist_id',
+    'Song': 'song_id',
+    'PlatformSong': 'platform_song_id',
+    'SyncLog': 'sync_id'
+}
+
+# Secondary indexes declared per table; primary keys are unique keys
+DEFAULT_INDEXES = {
+    'User_': [],
+    'Platform': [],
+    'UserPlatformAccount': ['user_id', 'auth_token'],
+    'Playlist': ['account_id'],
+    'Song': [],
+    'PlatformSong': ['song_id'],
+    'PlaylistSong': ['playlist_id', 'song_id'],
+    'SyncLog': ['user_id']
+}
+
+# Unique composite keys enforced per table
+DEFAULT_UNIQUE_KEYS = {
+    'User_': [('email',)],
+    'Platform': [('platform_name',)],
+    'Song': [('title', 'artist', 'album')],
+    'PlatformSong': [('song_id', 'platform_id', 'platform_specific_id')],
+    'PlaylistSong': [('playlist_id', 'song_id')]
+}
+
+# High-cardinality tables stored column by column: column -> storage kind,
+# 'int', 'text' or 'enum' for values that repeat across rows (see table_storage)
+COMPACT_TABLES = {
+    'Song': {'song_id': 'int', 'title': 'text', 'artist': 'enum', 'album': 'enum', 'duration': 'int'},
+    'PlatformSong': {'platform_song_id': 'int', 'song_id': 'int', 'platform_id': 'enum',
+                     'platform_specific_id': 'text', 'matched_at': 'enum', 'platform_title': 'text',
+                     'platform_artists': 'text', 'platform_album': 'enum', 'platform_duration': 'int'},
+    'PlaylistSong': {'playlist_id': 'int', 'song_id': 'int', 'added_at': 'text'}
+}
+
+class IntegrityError(ValueError):
+    """Raised when a write would violate a unique key"""
+
+class ReadWriteLock:
+    """Reentrant lock allowing many concurrent readers or a single writer.
+    
+    Waiting writers block new readers so writes are not starved. A thread
+    holding the write lock may also read; upgrading a read lock to a write
+    lock is not supported.
+    """
+    
     def __init__(self):
-        self.lock = threading.RLock()
+        self._cond = threading.Condition(threading.Lock())
+        self._readers: Dict[int, int] = {}
+        self._writer: Optional[int] = None
+        self._write_depth = 0
+        self._waiting_writers = 0
+    
+    def acquire_read(self) -> None:
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer != me and me not in self._readers:
+                while self._writer is not None or self._waiting_writers:
+                    self._cond.wait()
+            self._readers[me] = self._readers.get(me, 0) + 1
+    
+    def release_read(self) -> None:
+        me = threading.get_ident()
+        with self._cond:
+            self._readers[me] -= 1
+            if not self._readers[me]:
+                del self._readers[me]
+                if not self._readers:
+                    self._cond.notify_all()
+    
+    def acquire_write(self) -> None:
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._write_depth += 1
+                return
+            if me in self._readers:
+                raise RuntimeError("Cannot upgrade a read lock to a write lock")
+            self._waiting_writers += 1
+            try:
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+            finally:
+                self._waiting_writers -= 1
+            self._writer = me
+            self._write_depth = 1
+    
+    def release_write(self) -> None:
+        with self._cond:
+            self._write_depth -= 1
+            if not self._write_depth:
+                self._writer = None
+                self._cond.notify_all()
+    
+    @contextmanager
+    def read(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+    
+    @contextmanager
+    def write(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
+
+class StorageEngine:
+    """Interface shared by the storage backends behind the helper functions"""
+    
+    def insert(self, table: str, data: Dict[str, Any]) -> int:
+        """Insert a record and return the auto-generated ID"""
+        raise NotImplementedError
+    
+    def insert_many(self, table: str, rows: List[Dict[str, Any]]) -> List[int]:
+        """Insert a batch of records atomically and return their IDs"""
+        raise NotImplementedError
+    
+    def upsert(self, table: str, data: Dict[str, Any],
+               update: Optional[Dict[str, Any]] = None) -> int:
+        """Insert a record unless one with the same unique key exists"""
+        raise NotImplementedError
+    
+    def upsert_many(self, table: str, rows: List[Dict[str, Any]],
+                    update: Optional[Dict[str, Any]] = None) -> List[int]:
+        """Upsert a batch of records and return their IDs"""
+        raise NotImplementedError
+    
+    def select(self, table: str, where: Optional[Dict[str, Any]] = None,
+               columns: Optional[List[str]] = None, limit: Optional[int] = None,
+               offset: int = 0, copy: bool = False) -> List[Mapping[str, Any]]:
+        """Select records from a table.
+        
+        Rows are read-only mappings unless `copy` is set, in which case they
+        are mutable dicts. `columns` projects each row to those columns.
+        """
+        return list(self.iter_select(table, where, columns, limit, offset, copy))
+    
+    def iter_select(self, table: str, where: Optional[Dict[str, Any]] = None,
+                    columns: Optional[List[str]] = None, limit: Optional[int] = None,
+                    offset: int = 0, copy: bool = False) -> Iterator[Mapping[str, Any]]:
+        """Lazily yield the rows select() would return"""
+        raise NotImplementedError
+    
+    def join(self, left: str, right: str, on: str, where: Optional[Dict[str, Any]] = None,
+             columns: Optional[List[str]] = None, order_by: Optional[str] = None,
+             descending: bool = False) -> List[Dict[str, Any]]:
+        """Inner equi-join of two tables on a shared column.
+        
+        `where` filters the left table. Each result row holds the left
+        record's columns overlaid with the matching right record's, limited
+        to `columns` when given and sorted by `order_by` when given.
+        """
+        raise NotImplementedError
+    
+    def update(self, table: str, data: Dict[str, Any], where: Dict[str, Any]) -> int:
+        """Update records in a table"""
+        raise NotImplementedError
+    
+    def delete(self, table: str, where: Dict[str, Any]) -> int:
+        """Delete records from a table"""
+        raise NotImplementedError
+    
+    def read_tables(self, *tables: str):
+        """Context manager giving a consistent view of several tables"""
+        raise NotImplementedError
+    
+    def write_tables(self, *tables: str):
+        """Context manager making writes to several tables atomic"""
+        raise NotImplementedError
+
+# Thread-safe in-memory database implementation
+class InMemoryDatabase(StorageEngine):
+    def __init__(self, indexes: Optional[Dict[str, List[str]]] = None,
+                 unique_keys: Optional[Dict[str, List[Tuple[str, ...]]]] = None,
+                 compact_tables: Optional[Dict[str, Dict[str, str]]] = None):
+        self.compact_tables = dict(COMPACT_TABLES if compact_tables is None else compact_tables)
+        # table -> RowTable or ColumnTable; rows are addressed by position
         self.tables = {
-            'User_': [],
-            'Admin': [],
-            'Platform': [],
-            'UserPlatformAccount': [],
-            'Playlist': [],
-            'Song': [],
-            'PlatformSong': [],
-            'PlaylistSong': [],
-            'SyncLog': []
+            table: self._new_table(table)
+            for table in ('User_', 'Admin', 'Platform', 'UserPlatformAccount', 'Playlist',
+                          'Song', 'PlatformSong', 'PlaylistSong', 'SyncLog')
         }
         self.auto_increment_counters = {
             'User_': 1,
@@ -27,93 +215,661 @@ class InMemoryDatabase:
             'PlatformSong': 1,
             'SyncLog': 1
         }
+        self.primary_keys = dict(PRIMARY_KEYS)
+        # One reader/writer lock per table
+        self.locks = {table: ReadWriteLock() for table in self.tables}
+        # Optional append-only log, see enable_persistence()
+        self.wal = None
+        self.snapshot_every = 0
+        self._checkpointing = threading.Event()
+        # Indexes and keys of restored tables, built on first use: table -> builder
+        self._deferred_keys: Dict[str, Any] = {}
+        self._deferred_lock = threading.Lock()
+        # Deleted rows stay in their table until compaction: table -> {position}
+        self.tombstones: Dict[str, set] = {table: set() for table in self.tables}
+        self.compact_ratio = 0.25
+        self.compact_min_dead = 1000
+        self._compacting: set = set()
+        # table -> column -> value -> position, or a set of positions
+        self.indexes: Dict[str, Dict[str, Dict[Any, Any]]] = {
+            table: {} for table in self.tables
+        }
+        for table, columns in (DEFAULT_INDEXES if indexes is None else indexes).items():
+            for column in columns:
+                self.create_index(table, column)
+        # table -> key columns -> KeyIndex of key value (tuple if composite) -> position
+        self.unique_keys: Dict[str, Dict[Tuple[str, ...], KeyIndex]] = {
+            table: {} for table in self.tables
+        }
+        for table, id_field in self.primary_keys.items():
+            self.create_unique_key(table, (id_field,))
+        for table, keys in (DEFAULT_UNIQUE_KEYS if unique_keys is None else unique_keys).items():
+            for columns in keys:
+                self.create_unique_key(table, columns)
+    
+    def _new_table(self, table: str) -> Any:
+        """Empty storage for a table: typed columns if declared compact, else dicts"""
+        kinds = self.compact_tables.get(table)
+        return ColumnTable(kinds) if kinds is not None else RowTable()
+    
+    def enable_persistence(self, directory: str, snapshot_every: int = 100000,
+                           flush_interval: float = 0.05) -> None:
+        """Restore state from `directory` and log every later mutation there.
         
+        Writes are group-committed by a background thread, so a mutation is
+        durable within `flush_interval` seconds. A compacted snapshot is
+        taken after every `snapshot_every` logged operations. Raises
+        RuntimeError if another process is already using `directory`.
+        """
+        from persistence import WriteAheadLog
+        
+        wal = WriteAheadLog(directory, flush_interval=flush_interval)
+        # Restoring allocates millions of long-lived objects; skip GC passes over them
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            with self.write_tables(*self.tables):
+                state, entries = wal.load()
+                if state is not None:
+                    self._load_state(state)
+                for entry in entries:
+                    self._replay(entry)
+                wal.start()
+                self.wal = wal
+                self.snapshot_every = snapshot_every
+        finally:
+            if gc_enabled:
+                gc.enable()
+        atexit.register(wal.close)
+        if self._deferred_keys:
+            threading.Thread(target=self._build_all_deferred_keys, name='db-build-keys', daemon=True).start()
+    
+    def _load_state(self, state: Dict[str, Any]) -> None:
+        """Replace all tables with a snapshot.
+        
+        Each table's indexes and unique keys are rebuilt in bulk later, in
+        the background or when the table is first used, so a restart only
+        pays for loading records.
+        """
+        self.auto_increment_counters.update(state['counters'])
+        for table, stored in state['tables'].items():
+            self.tables[table] = self._new_table(table)
+            self.tables[table].load(stored)
+            self.tombstones[table] = set()
+            self.locks.setdefault(table, ReadWriteLock())
+            self.indexes.setdefault(table, {})
+            self.unique_keys.setdefault(table, {})
+            # Column-wise snapshots already hold each column's values
+            stored_columns = dict(zip(stored['fields'], stored['columns'])) if isinstance(stored, dict) else {}
+            self._deferred_keys[table] = partial(self._build_keys, table, stored_columns)
+    
+    def _build_keys(self, table: str, stored_columns: Optional[Dict[str, Any]] = None) -> None:
+        """Rebuild a table's indexes and unique keys from its rows in bulk"""
+        rows = self.tables[table]
+        stored_columns = stored_columns or {}
+        dead = self.tombstones.get(table)
+        positions = [pos for pos in range(len(rows)) if pos not in dead] if dead else None
+        
+        def column_values(column: str) -> List[Any]:
+            values = stored_columns.get(column)
+            if values is None or len(values) < len(rows):
+                # Also covers rows replayed from the log after the snapshot
+                values = rows.column(column)
+            return values if positions is None else [values[pos] for pos in positions]
+        
+        for column in self.indexes[table]:
+            index: Dict[Any, Any] = {}
+            for pos, value in zip(positions or range(len(rows)), column_values(column)):
+                self._bucket_add(index, value, pos)
+            self.indexes[table][column] = index
+        for columns in self.unique_keys[table]:
+            values = [column_values(column) for column in columns]
+            keys = values[0] if len(columns) == 1 else zip(*values)
+            self.unique_keys[table][columns] = KeyIndex(self._key_reader(table, columns), keys, positions)
+    
+    def _build_deferred_keys(self, table: Optional[str] = None) -> None:
+        """Build the pending keys of one restored table, or of all of them"""
+        with self._deferred_lock:
+            gc_enabled = gc.isenabled()
+            gc.disable()
+            try:
+                for name in [table] if table is not None else list(self._deferred_keys):
+                    build = self._deferred_keys.get(name)
+                    if build is not None:
+                        build()
+                        # Removed only once built, so other threads keep waiting until then
+                        del self._deferred_keys[name]
+            finally:
+                if gc_enabled:
+                    gc.enable()
+    
+    def _build_all_deferred_keys(self) -> None:
+        """Build every pending table's keys, smallest table first.
+        
+        Runs in the background after a restore, so the first request for a
+        table usually finds its keys ready instead of building them.
+        """
+        with self._deferred_lock:
+            pending = sorted(self._deferred_keys, key=lambda table: len(self.tables[table]))
+        for table in pending:
+            self._build_deferred_keys(table)
+    
+    def _key_reader(self, table: str, columns: Tuple[str, ...]):
+        """Return a function reading a row's key, by position, for a KeyIndex"""
+        tables = self.tables
+        return lambda pos: tables[table].key(pos, columns)
+    
+    def _snapshot_table(self, table: str) -> Any:
+        """Copy a table for a snapshot; compact tables are stored column-wise"""
+        rows = self.tables[table]
+        dead = self.tombstones.get(table)
+        if dead:
+            rows = rows.take(pos for pos in range(len(rows)) if pos not in dead)
+        return rows.snapshot()
+    
+    def _replay(self, entry: tuple) -> None:
+        """Apply one logged operation without logging it again.
+        
+        Inserts into a restored table whose keys are still pending are only
+        appended, since the deferred build covers them; updates and deletes
+        need the keys to find their rows, so they build that table's.
+        """
+        op, table = entry[0], entry[1]
+        deferred = table in self._deferred_keys
+        if deferred and op not in ('insert', 'row'):
+            self._build_deferred_keys(table)
+        if op in ('insert', 'row'):
+            row = entry[2] if op == 'insert' else dict(zip(entry[2], entry[3]))
+            if table not in self.tables:
+                self.tables[table] = self._new_table(table)
+            pos = self.tables[table].append(row)
+            if not deferred:
+                self._index_add(table, pos, row)
+                self._unique_add(table, pos, row)
+            id_field = self.primary_keys.get(table)
+            if row.get(id_field) is not None:
+                self.auto_increment_counters[table] = max(
+                    self.auto_increment_counters.get(table, 1), row[id_field] + 1)
+        elif op == 'update':
+            for pos in [pos for pos in self._candidates(table, entry[3])
+                        if self._matches(table, pos, entry[3])]:
+                self._apply_update(table, pos, entry[2])
+        elif op == 'delete':
+            self._delete(table, entry[2])
+    
+    def _log_insert(self, table: str, row: Dict[str, Any]) -> None:
+        """Log an insert as an immutable copy of the row"""
+        if self.wal is None:
+            return
+        rows = self.tables[table]
+        if isinstance(rows, ColumnTable) and rows.field_set.issuperset(row):
+            # A plain tuple of values pickles several times faster than a dict
+            self._log(('row', table, rows.fields, tuple(map(row.get, rows.fields))))
+        else:
+            self._log(('insert', table, dict(row)))
+    
+    def _log(self, entry: tuple) -> None:
+        """Append an operation to the log, if persistence is enabled.
+        
+        The entry is pickled later by the log's writer thread, so it must
+        not share mutable state with the tables or the caller.
+        """
+        if self.wal is None:
+            return
+        count = self.wal.append(entry)
+        if self.snapshot_every and count >= self.snapshot_every and not self._checkpointing.is_set():
+            # Snapshotting needs every table lock, and the caller holds one
+            self._checkpointing.set()
+            threading.Thread(target=self.checkpoint, name='db-checkpoint', daemon=True).start()
+    
+    def checkpoint(self) -> None:
+        """Write a compacted snapshot and drop the log segments it covers"""
+        if self.wal is None:
+            return
+        try:
+            with self.write_tables(*self.tables):
+                number = self.wal.rotate()
+                state = {
+                    'counters': dict(self.auto_increment_counters),
+                    'tables': {table: self._snapshot_table(table) for table in self.tables}
+                }
+            self.wal.write_snapshot(number, state)
+        except OSError as e:
+            logging.error(f"Error writing database snapshot: {e}")
+        finally:
+            self._checkpointing.clear()
+    
+    def _record_where(self, table: str, pos: int) -> Dict[str, Any]:
+        """Return a where clause identifying exactly the row at `pos`"""
+        rows = self.tables[table]
+        id_field = self.primary_keys.get(table)
+        if id_field is not None:
+            return {id_field: rows.get(pos, id_field)}
+        columns = next(iter(self.unique_keys.get(table, {})), None)
+        if columns is None:
+            return dict(rows.row(pos))
+        return {column: rows.get(pos, column) for column in columns}
+    
+    def _table_lock(self, table: str) -> ReadWriteLock:
+        if self._deferred_keys and table in self._deferred_keys:
+            self._build_deferred_keys(table)
+        lock = self.locks.get(table)
+        if lock is None:
+            lock = self.locks.setdefault(table, ReadWriteLock())
+        return lock
+    
+    @contextmanager
+    def read_tables(self, *tables: str):
+        """Hold shared locks on several tables, acquired in a fixed order"""
+        with ExitStack() as stack:
+            for table in sorted(set(tables)):
+                stack.enter_context(self._table_lock(table).read())
+            yield
+    
+    @contextmanager
+    def write_tables(self, *tables: str):
+        """Hold exclusive locks on several tables, acquired in a fixed order"""
+        with ExitStack() as stack:
+            for table in sorted(set(tables)):
+                stack.enter_context(self._table_lock(table).write())
+            yield
+    
+    def create_index(self, table: str, column: str) -> None:
+        """Declare a hash index on a column, built from the existing rows"""
+        with self._table_lock(table).write():
+            table_indexes = self.indexes.setdefault(table, {})
+            if column in table_indexes:
+                return
+            rows = self.tables[table]
+            index: Dict[Any, Any] = {}
+            for pos in self._live_positions(table):
+                self._bucket_add(index, rows.get(pos, column), pos)
+            table_indexes[column] = index
+    
+    def create_unique_key(self, table: str, columns: Tuple[str, ...]) -> None:
+        """Declare a unique composite key, built from the existing rows"""
+        with self._table_lock(table).write():
+            columns = tuple(columns)
+            table_keys = self.unique_keys.setdefault(table, {})
+            if columns in table_keys:
+                return
+            rows = self.tables[table]
+            key_index = KeyIndex(self._key_reader(table, columns))
+            for pos in self._live_positions(table):
+                key = rows.key(pos, columns)
+                if key in key_index:
+                    raise IntegrityError(f"Duplicate {table} key {columns}={key}")
+                key_index.add(key, pos)
+            table_keys[columns] = key_index
+    
+    @staticmethod
+    def _key(row: Mapping[str, Any], columns: Tuple[str, ...]) -> Any:
+        """Unique key of a row; single-column keys skip the tuple"""
+        if len(columns) == 1:
+            return row.get(columns[0])
+        return tuple(row.get(column) for column in columns)
+    
+    def _check_unique(self, table: str, row: Mapping[str, Any], ignore: Optional[int] = None) -> None:
+        """Raise IntegrityError if another row already holds one of the row's keys"""
+        for columns, key_index in self.unique_keys.get(table, {}).items():
+            existing = key_index.get(self._key(row, columns))
+            if existing is not None and existing != ignore:
+                raise IntegrityError(f"Duplicate {table} key {columns}")
+    
+    def _unique_add(self, table: str, pos: int, row: Mapping[str, Any]) -> None:
+        for columns, key_index in self.unique_keys.get(table, {}).items():
+            key_index.add(self._key(row, columns), pos)
+    
+    def _unique_remove(self, table: str, pos: int, row: Mapping[str, Any]) -> None:
+        for columns, key_index in self.unique_keys.get(table, {}).items():
+            key_index.remove(self._key(row, columns), pos)
+    
+    def _find_unique(self, table: str, data: Dict[str, Any]) -> Optional[int]:
+        """Return the position of the row sharing a unique key with data, if any"""
+        for columns, key_index in self.unique_keys.get(table, {}).items():
+            if all(column in data for column in columns):
+                existing = key_index.get(self._key(data, columns))
+                if existing is not None:
+                    return existing
+        return None
+    
+    @staticmethod
+    def _bucket_add(index: Dict[Any, Any], value: Any, pos: int) -> None:
+        """Add a position to an index bucket; a lone position is kept unboxed"""
+        bucket = index.get(value)
+        if bucket is None:
+            index[value] = pos
+        elif type(bucket) is int:
+            index[value] = {bucket, pos}
+        else:
+            bucket.add(pos)
+    
+    @staticmethod
+    def _bucket(index: Dict[Any, Any], value: Any) -> Iterable[int]:
+        """Positions in an index bucket"""
+        bucket = index.get(value)
+        if bucket is None:
+            return ()
+        return (bucket,) if type(bucket) is int else bucket
+    
+    def _index_add(self, table: str, pos: int, row: Mapping[str, Any], columns=None) -> None:
+        """Add a row to the table's indexes"""
+        for column, index in self.indexes.get(table, {}).items():
+            if columns is None or column in columns:
+                self._bucket_add(index, row.get(column), pos)
+    
+    def _index_remove(self, table: str, pos: int, row: Mapping[str, Any], columns=None) -> None:
+        """Remove a row from the table's indexes"""
+        for column, index in self.indexes.get(table, {}).items():
+            if columns is None or column in columns:
+                value = row.get(column)
+                bucket = index.get(value)
+                if bucket == pos:
+                    del index[value]
+                elif type(bucket) is set:
+                    bucket.discard(pos)
+                    if not bucket:
+                        del index[value]
+    
+    def _live_positions(self, table: str) -> Iterable[int]:
+        """Iterate a table's row positions, skipping tombstoned ones"""
+        rows = self.tables.get(table)
+        if rows is None:
+            return ()
+        dead = self.tombstones.get(table)
+        if not dead:
+            return range(len(rows))
+        return (pos for pos in range(len(rows)) if pos not in dead)
+    
+    def _candidates(self, table: str, where: Dict[str, Any]) -> Iterable[int]:
+        """Return the positions that may match, using the most selective index"""
+        for columns, key_index in self.unique_keys.get(table, {}).items():
+            if all(column in where for column in columns):
+                try:
+                    pos = key_index.get(self._key(where, columns))
+                except TypeError:
+                    break
+                return [pos] if pos is not None else []
+        
+        best = None
+        for column, index in self.indexes.get(table, {}).items():
+            if column not in where:
+                continue
+            try:
+                bucket = self._bucket(index, where[column])
+            except TypeError:
+                # Unhashable lookup value, cannot use the index
+                continue
+            if best is None or len(bucket) < len(best):
+                best = bucket
+        if best is None:
+            return self._live_positions(table)
+        return list(best)
+    
+    def _matches(self, table: str, pos: int, where: Dict[str, Any]) -> bool:
+        rows = self.tables[table]
+        for key, value in where.items():
+            if rows.get(pos, key) != value:
+                return False
+        return True
+    
     def insert(self, table: str, data: Dict[str, Any]) -> int:
         """Insert a record and return the auto-generated ID"""
-        with self.lock:
+        with self._table_lock(table).write():
+            row = dict(data)
             # Generate auto-increment ID
-            if table in self.auto_increment_counters:
-                id_field = f"{table.lower()}_id" if table != 'User_' else 'user_id'
-                if table == 'Admin':
-                    id_field = 'admin_id'
-                
-                record = data.copy()
-                record[id_field] = self.auto_increment_counters[table]
+            id_field = self.primary_keys.get(table) if table in self.auto_increment_counters else None
+            if id_field is not None:
+                row[id_field] = self.auto_increment_counters[table]
+            self._check_unique(table, row)
+            pos = self.tables[table].append(row)
+            if id_field is not None:
                 self.auto_increment_counters[table] += 1
-                
-                self.tables[table].append(record)
-                return record[id_field]
-            else:
-                # For tables without auto-increment
-                self.tables[table].append(data)
-                return 0
-    
-    def select(self, table: str, where: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
-        """Select records from a table"""
-        with self.lock:
-            records = self.tables.get(table, [])
+            self._index_add(table, pos, row)
+            self._unique_add(table, pos, row)
+            self._log_insert(table, row)
+            return row[id_field] if id_field is not None else 0
+    
+    def insert_many(self, table: str, rows: List[Dict[str, Any]]) -> List[int]:
+        """Insert a batch of records under one lock hold and return their IDs.
+        
+        The batch is checked against unique keys up front, so either every
+        row is inserted or none are.
+        """
+        with self._table_lock(table).write():
+            id_field = self.primary_keys.get(table)
+            for columns, key_index in self.unique_keys.get(table, {}).items():
+                if id_field in columns:
+                    # Assigned on insert
+                    continue
+                seen = set()
+                for row in rows:
+                    key = self._key(row, columns)
+                    if key in key_index or key in seen:
+                        raise IntegrityError(f"Duplicate {table} key {columns}")
+                    seen.add(key)
+            return [self.insert(table, row) for row in rows]
+    
+    def upsert_many(self, table: str, rows: List[Dict[str, Any]],
+                    update: Optional[Dict[str, Any]] = None) -> List[int]:
+        """Upsert a batch of records under one lock hold and return their IDs"""
+        with self._table_lock(table).write():
+            return [self.upsert(table, row, update) for row in rows]
+    
+    def upsert(self, table: str, data: Dict[str, Any],
+               update: Optional[Dict[str, Any]] = None) -> int:
+        """Insert a record unless one with the same unique key exists.
+        
+        An existing record is left as is unless `update` is given, in which
+        case those columns are written to it. Returns the record's ID.
+        """
+        with self._table_lock(table).write():
+            existing = self._find_unique(table, data)
+            if existing is None:
+                return self.insert(table, data)
+            
+            if update:
+                self._apply_update(table, existing, update)
+                self._log(('update', table, dict(update), self._record_where(table, existing)))
+            id_field = self.primary_keys.get(table)
+            return self.tables[table].get(existing, id_field, 0) if id_field is not None else 0
+    
+    def iter_select(self, table: str, where: Optional[Dict[str, Any]] = None,
+                    columns: Optional[List[str]] = None, limit: Optional[int] = None,
+                    offset: int = 0, copy: bool = False) -> Iterator[Mapping[str, Any]]:
+        """Lazily yield matching records as read-only views.
+        
+        Only the matching rows are collected under the lock (references for
+        dict tables, copies for column tables); views, projections and
+        copies are made one row at a time as the caller consumes them.
+        """
+        stop = None if limit is None else offset + limit
+        with self._table_lock(table).read():
             if where is None:
-                return records.copy()
+                positions = islice(self._live_positions(table), offset, stop)
+            else:
+                positions = islice((pos for pos in self._candidates(table, where)
+                                    if self._matches(table, pos, where)), offset, stop)
+            rows = self.tables[table].rows_at(positions) if table in self.tables else []
+        
+        for row in rows:
+            if columns is not None:
+                yield {column: row.get(column) for column in columns}
+            elif copy:
+                yield row.copy()
+            else:
+                yield MappingProxyType(row)
+    
+    def join(self, left: str, right: str, on: str, where: Optional[Dict[str, Any]] = None,
+             columns: Optional[List[str]] = None, order_by: Optional[str] = None,
+             descending: bool = False) -> List[Dict[str, Any]]:
+        """Inner equi-join of two tables, probing the right table by index"""
+        with self.read_tables(left, right):
+            left_rows, right_rows = self.tables[left], self.tables[right]
+            if where:
+                left_positions = [pos for pos in self._candidates(left, where)
+                                  if self._matches(left, pos, where)]
+            else:
+                left_positions = self._live_positions(left)
+            lookup = self._join_lookup(right, on)
             
-            filtered = []
-            for record in records:
-                match = True
-                for key, value in where.items():
-                    if record.get(key) != value:
-                        match = False
-                        break
-                if match:
-                    filtered.append(record)
-            return filtered
+            rows = []
+            for left_pos in left_positions:
+                matches = lookup(left_rows.get(left_pos, on))
+                if not matches:
+                    continue
+                left_record = left_rows.row(left_pos)
+                for right_pos in matches:
+                    right_record = right_rows.row(right_pos)
+                    if columns is None:
+                        row = dict(left_record)
+                        row.update(right_record)
+                    else:
+                        row = {column: right_record[column] if column in right_record
+                               else left_record.get(column) for column in columns}
+                    rows.append(row)
+        
+        if order_by is not None:
+            rows.sort(key=lambda row: row.get(order_by), reverse=descending)
+        return rows
+    
+    def _join_lookup(self, table: str, column: str):
+        """Return a function mapping a column value to the table's matching positions"""
+        key_index = self.unique_keys.get(table, {}).get((column,))
+        if key_index is not None:
+            def lookup(value: Any) -> List[int]:
+                pos = key_index.get(value)
+                return [pos] if pos is not None else []
+            return lookup
+        
+        index = self.indexes.get(table, {}).get(column)
+        if index is None:
+            # No index on the join column: build a hash table for this join
+            index = {}
+            rows = self.tables[table]
+            for pos in self._live_positions(table):
+                self._bucket_add(index, rows.get(pos, column), pos)
+        return lambda value: list(self._bucket(index, value))
     
     def update(self, table: str, data: Dict[str, Any], where: Dict[str, Any]) -> int:
         """Update records in a table"""
-        with self.lock:
-            updated_count = 0
-            records = self.tables.get(table, [])
-            for record in records:
-                match = True
-                for key, value in where.items():
-                    if record.get(key) != value:
-                        match = False
-                        break
-                if match:
-                    record.update(data)
-                    updated_count += 1
-            return updated_count
+        with self._table_lock(table).write():
+            matched = [pos for pos in self._candidates(table, where)
+                       if self._matches(table, pos, where)]
+            rows = self.tables.get(table)
+            applied = []
+            try:
+                for pos in matched:
+                    previous = {column: rows.get(pos, column) for column in data}
+                    self._apply_update(table, pos, data)
+                    applied.append((pos, previous))
+            except IntegrityError:
+                # Undo in reverse so each row gets back a key nothing else holds;
+                # a half-applied update would never reach the log
+                for pos, previous in reversed(applied):
+                    self._apply_update(table, pos, previous)
+                raise
+            if matched:
+                self._log(('update', table, dict(data), dict(where)))
+            return len(matched)
+    
+    def _apply_update(self, table: str, pos: int, data: Dict[str, Any]) -> None:
+        """Update a single row in place, keeping indexes and unique keys current"""
+        rows = self.tables[table]
+        indexed = [column for column in data if column in self.indexes.get(table, {})]
+        keyed = any(column in data
+                    for columns in self.unique_keys.get(table, {}) for column in columns)
+        if keyed or indexed:
+            current = dict(rows.row(pos))
+            updated = {**current, **data}
+        if keyed:
+            self._check_unique(table, updated, ignore=pos)
+            self._unique_remove(table, pos, current)
+        if indexed:
+            self._index_remove(table, pos, current, indexed)
+        rows.update(pos, data)
+        if indexed:
+            self._index_add(table, pos, updated, indexed)
+        if keyed:
+            self._unique_add(table, pos, updated)
     
     def delete(self, table: str, where: Dict[str, Any]) -> int:
         """Delete records from a table"""
-        with self.lock:
-            records = self.tables.get(table, [])
-            to_remove = []
-            for i, record in enumerate(records):
-                match = True
-                for key, value in where.items():
-                    if record.get(key) != value:
-                        match = False
-                        break
-                if match:
-                    to_remove.append(i)
-            
-            # Remove in reverse order to maintain indices
-            for i in reversed(to_remove):
-                records.pop(i)
-            
-            return len(to_remove)
+        with self._table_lock(table).write():
+            removed = self._delete(table, where)
+            if removed:
+                self._log(('delete', table, dict(where)))
+            return removed
+    
+    def _delete(self, table: str, where: Dict[str, Any]) -> int:
+        """Tombstone matching rows; the table is rebuilt later by compact()"""
+        matched = [pos for pos in self._candidates(table, where)
+                   if self._matches(table, pos, where)]
+        rows = self.tables[table]
+        dead = self.tombstones.setdefault(table, set())
+        for pos in matched:
+            row = rows.row(pos)
+            self._index_remove(table, pos, row)
+            self._unique_remove(table, pos, row)
+            dead.add(pos)
+        
+        if (len(dead) >= self.compact_min_dead
+                and len(dead) >= self.compact_ratio * len(rows)
+                and table not in self._compacting):
+            # The caller holds the table's write lock, so compact in the background
+            self._compacting.add(table)
+            threading.Thread(target=self.compact, args=(table,),
+                             name=f'db-compact-{table}', daemon=True).start()
+        return len(matched)
+    
+    def compact(self, table: str) -> int:
+        """Drop tombstoned rows from a table and return how many were removed.
+        
+        Surviving rows move to new positions, so the table's indexes and
+        keys are rebuilt.
+        """
+        try:
+            with self._table_lock(table).write():
+                dead = self.tombstones.get(table)
+                if not dead:
+                    return 0
+                rows = self.tables[table]
+                self.tables[table] = rows.take(pos for pos in range(len(rows)) if pos not in dead)
+                self.tombstones[table] = set()
+                self._build_keys(table)
+                return len(rows) - len(self.tables[table])
+        finally:
+            self._compacting.discard(table)
+
+def create_database(url: Optional[str] = None) -> StorageEngine:
+    """Create the storage engine for a database URL.
+    
+    No URL selects the in-memory store; sqlite:/// and postgresql:// URLs
+    select the pooled SQL backend.
+    """
+    if not url:
+        return InMemoryDatabase()
+    
+    from sql_storage import SQLDatabase
+    return SQLDatabase(url)
 
 # Global database instance
-db = InMemoryDatabase()
+db = create_database(os.environ.get('SYNCTUNES_DATABASE_URL'))
 
 def init_database():
     """Initialize the database with default platforms"""
+    # Restore persisted state when a data directory is configured
+    data_dir = os.environ.get('SYNCTUNES_DATA_DIR')
+    if data_dir and isinstance(db, InMemoryDatabase):
+        db.enable_persistence(data_dir)
+    
     # Insert default platforms
-    db.insert('Platform', {
+    db.upsert('Platform', {
         'platform_name': 'Spotify',
         'api_details': 'Spotify Web API with OAuth 2.0'
     })
     
-    db.insert('Platform', {
+    db.upsert('Platform', {
         'platform_name': 'YouTube Music',
         'api_details': 'YouTube Music API via ytmusicapi'
     })
@@ -145,15 +901,37 @@ def get_user_accounts(user_id: int) -> List[Dict[str, Any]]:
     """Get all platform accounts for a user"""
     return db.select('UserPlatformAccount', {'user_id': user_id})
 
-def create_user_platform_account(user_id: int, platform_id: int, username: str, auth_token: str) -> int:
+def get_account_by_id(account_id: int) -> Optional[Dict[str, Any]]:
+    """Get a user platform account by ID"""
+    accounts = db.select('UserPlatformAccount', {'account_id': account_id})
+    return accounts[0] if accounts else None
+
+def get_account_by_token(auth_token: str) -> Optional[Dict[str, Any]]:
+    """Get the user platform account currently holding an access token"""
+    accounts = db.select('UserPlatformAccount', {'auth_token': auth_token})
+    return accounts[0] if accounts else None
+
+def create_user_platform_account(user_id: int, platform_id: int, username: str, auth_token: str,
+                                 refresh_token: Optional[str] = None,
+                                 token_expires_at: Optional[str] = None) -> int:
     """Create a user platform account"""
     return db.insert('UserPlatformAccount', {
         'user_id': user_id,
         'platform_id': platform_id,
         'username_on_platform': username,
-        'auth_token': auth_token
+        'auth_token': auth_token,
+        'refresh_token': refresh_token,
+        'token_expires_at': token_expires_at
     })
 
+def update_account_tokens(account_id: int, auth_token: str, refresh_token: Optional[str] = None,
+                          token_expires_at: Optional[str] = None) -> int:
+    """Store a new access token, keeping the current refresh token unless a new one is given"""
+    data = {'auth_token': auth_token, 'token_expires_at': token_expires_at}
+    if refresh_token:
+        data['refresh_token'] = refresh_token
+    return db.update('UserPlatformAccount', data, {'account_id': account_id})
+
 def get_playlists_by_account(account_id: int) -> List[Dict[str, Any]]:
     """Get all playlists for an account"""
     return db.select('Playlist', {'account_id': account_id})
@@ -169,11 +947,7 @@ def create_playlist(account_id: int, name: str, description: str = "") -> int:
 
 def get_or_create_song(title: str, artist: str, album: str = "", duration: int = 0) -> int:
     """Get existing song or create new one"""
-    songs = db.select('Song', {'title': title, 'artist': artist, 'album': album})
-    if songs:
-        return songs[0]['song_id']
-    
-    return db.insert('Song', {
+    return db.upsert('Song', {
         'title': title,
         'artist': artist,
         'album': album,
@@ -182,31 +956,107 @@ def get_or_create_song(title: str, artist: str, album: str = "", duration: int =
 
 def add_platform_song(song_id: int, platform_id: int, platform_specific_id: str) -> int:
     """Add platform-specific song mapping"""
-    # Check if mapping already exists
-    existing = db.select('PlatformSong', {
+    return db.upsert('PlatformSong', {
         'song_id': song_id,
         'platform_id': platform_id,
         'platform_specific_id': platform_specific_id
     })
-    if existing:
-        return existing[0]['platform_song_id']
+
+def get_or_create_songs(songs: List[Dict[str, Any]]) -> List[int]:
+    """Get or create a batch of songs given as title/artist/album/duration dicts"""
+    return db.upsert_many('Song', [{
+        'title': song['title'],
+        'artist': song['artist'],
+        'album': song.get('album', ''),
+        'duration': song.get('duration', 0)
+    } for song in songs])
+
+def add_platform_songs(platform_id: int, mappings: List[Tuple[int, str]],
+                       matched_at: Optional[str] = None,
+                       details: Optional[List[Dict[str, Any]]] = None) -> List[int]:
+    """Add a batch of (song_id, platform_specific_id) mappings for one platform.
     
-    return db.insert('PlatformSong', {
+    With `matched_at`, new and existing mappings are stamped with it.
+    `details` gives extra PlatformSong columns per mapping (the platform's
+    own title, album, ...), written to new and existing mappings alike.
+    """
+    rows = [{
         'song_id': song_id,
         'platform_id': platform_id,
         'platform_specific_id': platform_specific_id
-    })
+    } for song_id, platform_specific_id in mappings]
+    if matched_at is None and details is None:
+        return db.upsert_many('PlatformSong', rows)
+    
+    with db.write_tables('PlatformSong'):
+        ids = []
+        for row, extra in zip(rows, details or [{}] * len(rows)):
+            update = dict(extra)
+            if matched_at is not None:
+                update['matched_at'] = matched_at
+            row.update(update)
+            ids.append(db.upsert('PlatformSong', row, update=update or None))
+        return ids
+
+def store_platform_matches(platform_id: int, matches: List[Tuple[Dict[str, Any], str]],
+                           matched_at: Optional[str] = None,
+                           details: Optional[List[Dict[str, Any]]] = None) -> List[int]:
+    """Persist (song, platform_specific_id) pairs in one bulk operation.
+    
+    Songs are given as title/artist/album/duration dicts; `details` is
+    passed on to add_platform_songs. Returns the song IDs in input order.
+    """
+    with db.write_tables('Song', 'PlatformSong'):
+        song_ids = get_or_create_songs([song for song, _ in matches])
+        add_platform_songs(platform_id, [
+            (song_id, platform_specific_id)
+            for song_id, (_, platform_specific_id) in zip(song_ids, matches)
+        ], matched_at, details)
+        return song_ids
+
+def get_platform_matches(platform_id: int, songs: List[Dict[str, Any]]) -> List[Optional[Dict[str, Any]]]:
+    """Look up stored mappings for a batch of title/artist/album dicts.
+    
+    Returns, in input order, the song's row merged with its most recently
+    matched mapping on the platform, or None where there is none.
+    """
+    results = []
+    with db.read_tables('Song', 'PlatformSong'):
+        for song in songs:
+            rows = db.select('Song', {
+                'title': song['title'],
+                'artist': song['artist'],
+                'album': song.get('album', '')
+            })
+            if not rows:
+                results.append(None)
+                continue
+            mappings = db.select('PlatformSong', {'song_id': rows[0]['song_id'], 'platform_id': platform_id})
+            if not mappings:
+                results.append(None)
+                continue
+            mapping = max(mappings, key=lambda mapping: mapping.get('matched_at') or '')
+            match = dict(rows[0])
+            match.update(mapping)
+            results.append(match)
+    return results
 
 def add_song_to_playlist(playlist_id: int, song_id: int) -> None:
     """Add song to playlist"""
-    # Check if song is already in playlist
-    existing = db.select('PlaylistSong', {'playlist_id': playlist_id, 'song_id': song_id})
-    if not existing:
-        db.insert('PlaylistSong', {
-            'playlist_id': playlist_id,
-            'song_id': song_id,
-            'added_at': datetime.now().isoformat()
-        })
+    db.upsert('PlaylistSong', {
+        'playlist_id': playlist_id,
+        'song_id': song_id,
+        'added_at': datetime.now().isoformat()
+    })
+
+def add_songs_to_playlist(playlist_id: int, song_ids: List[int]) -> None:
+    """Add a batch of songs to a playlist"""
+    added_at = datetime.now().isoformat()
+    db.upsert_many('PlaylistSong', [{
+        'playlist_id': playlist_id,
+        'song_id': song_id,
+        'added_at': added_at
+    } for song_id in song_ids])
 
 def create_sync_log(user_id: int, source_account_id: int, destination_account_id: int, 
                    playlist_id: int, total_songs: int, songs_added: int, songs_removed: int) -> int:
@@ -224,14 +1074,6 @@ def create_sync_log(user_id: int, source_account_id: int, destination_account_id
 
 def get_playlist_songs(playlist_id: int) -> List[Dict[str, Any]]:
     """Get all songs in a playlist with song details"""
-    playlist_songs = db.select('PlaylistSong', {'playlist_id': playlist_id})
-    songs_with_details = []
-    
-    for ps in playlist_songs:
-        songs = db.select('Song', {'song_id': ps['song_id']})
-        if songs:
-            song_data = songs[0].copy()
-            song_data['added_at'] = ps['added_at']
-            songs_with_details.append(song_data)
-    
-    return songs_with_details
+    return db.join('PlaylistSong', 'Song', on='song_id', where={'playlist_id': playlist_id},
+                   columns=['song_id', 'title', 'artist', 'album', 'duration', 'added_at'],
+                   order_by='added_at')
@@ -0,0 +1,124 @@
+import os
+import json
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from cache import LRUCache
+from database import get_platform_by_name, get_platform_matches, store_platform_matches
+
+MATCH_TTL = float(os.getenv('YTMUSIC_MATCH_TTL', str(30 * 24 * 3600)))
+MATCH_CACHE_SIZE = int(os.getenv('YTMUSIC_MATCH_CACHE_SIZE', '100000'))
+
+def _normalize(text: Any) -> str:
+    return ' '.join(str(text or '').casefold().split())
+
+def song_artists(song: Dict[str, Any]) -> List[str]:
+    artists = song.get('artists', [])
+    return [artists] if isinstance(artists, str) else list(artists)
+
+def match_key(song: Dict[str, Any]) -> Tuple[str, Tuple[str, ...], str]:
+    """Cache key for a source track: normalized title, artists and album"""
+    return (
+        _normalize(song.get('name', song.get('title', ''))),
+        tuple(_normalize(artist) for artist in song_artists(song)),
+        _normalize(song.get('album', ''))
+    )
+
+def song_row(song: Dict[str, Any]) -> Dict[str, Any]:
+    """The Song table row for a source track"""
+    return {
+        'title': song.get('name', song.get('title', '')),
+        'artist': ', '.join(song_artists(song)),
+        'album': song.get('album', '') or '',
+        'duration': song.get('duration_ms', 0) // 1000
+    }
+
+def match_details(match: Dict[str, Any]) -> Dict[str, Any]:
+    """PlatformSong columns describing the matched YouTube Music track"""
+    return {
+        'platform_title': match.get('title') or '',
+        'platform_artists': json.dumps(match.get('artists') or []),
+        'platform_album': match.get('album') or '',
+        'platform_duration': match.get('duration') or 0
+    }
+
+class MatchCache:
+    """Shared cache of YouTube Music matches for source tracks.
+
+    Lookups try an in-memory LRU keyed by normalized title/artists/album,
+    then the Song and PlatformSong tables, so matches from earlier syncs by
+    any user survive restarts. A stored match is trusted for `ttl` seconds
+    after its search (PlatformSong.matched_at) and is searched again after.
+    Stored matches keep the YouTube track's own title, artists, album and
+    duration, so a cached result is the same as the fresh match was.
+    """
+
+    def __init__(self, platform_name: str = 'YouTube Music', max_entries: int = MATCH_CACHE_SIZE,
+                 ttl: float = MATCH_TTL):
+        self.platform_name = platform_name
+        self.ttl = ttl
+        self.memory = LRUCache(max_entries, ttl=ttl)
+        self._lock = threading.Lock()
+        self._stats = {'memory_hits': 0, 'stored_hits': 0, 'misses': 0}
+
+    def _platform_id(self) -> Optional[int]:
+        platform = get_platform_by_name(self.platform_name)
+        return platform['platform_id'] if platform else None
+
+    def get_many(self, songs: List[Dict[str, Any]]) -> List[Optional[Dict[str, Any]]]:
+        """Cached matches for each song in order, None where a search is needed"""
+        results: List[Optional[Dict[str, Any]]] = [self.memory.get(match_key(song)) for song in songs]
+        missing = [i for i, match in enumerate(results) if match is None]
+        memory_hits = len(songs) - len(missing)
+
+        stored_hits = 0
+        platform_id = self._platform_id() if missing else None
+        if platform_id is not None:
+            now = datetime.now()
+            stored = get_platform_matches(platform_id, [song_row(songs[i]) for i in missing])
+            for i, row in zip(missing, stored):
+                # Mappings stored without the matched track's details are searched again
+                if row is None or not row.get('matched_at') or row.get('platform_title') is None:
+                    continue
+                remaining = (datetime.fromisoformat(row['matched_at']) + timedelta(seconds=self.ttl) - now).total_seconds()
+                if remaining <= 0:
+                    continue
+                match = {
+                    'videoId': row['platform_specific_id'],
+                    'title': row['platform_title'],
+                    'artists': json.loads(row['platform_artists'] or '[]'),
+                    'album': row['platform_album'] or '',
+                    'duration': row['platform_duration'] or 0
+                }
+                self.memory.put(match_key(songs[i]), match, ttl=remaining)
+                results[i] = match
+                stored_hits += 1
+
+        with self._lock:
+            self._stats['memory_hits'] += memory_hits
+            self._stats['stored_hits'] += stored_hits
+            self._stats['misses'] += len(missing) - stored_hits
+        return results
+
+    def put_many(self, matches: List[Tuple[Dict[str, Any], Dict[str, Any]]]) -> None:
+        """Remember fresh (song, match) search results in memory and in the tables"""
+        if not matches:
+            return
+        for song, match in matches:
+            self.memory.put(match_key(song), match)
+        platform_id = self._platform_id()
+        if platform_id is not None:
+            store_platform_matches(platform_id, [(song_row(song), match['videoId']) for song, match in matches],
+                                   matched_at=datetime.now().isoformat(),
+                                   details=[match_details(match) for _, match in matches])
+
+    def metrics(self) -> Dict[str, Any]:
+        """Hit counts by level and the overall hit rate"""
+        with self._lock:
+            metrics: Dict[str, Any] = dict(self._stats)
+        lookups = metrics['memory_hits'] + metrics['stored_hits'] + metrics['misses']
+        metrics['hit_rate'] = (metrics['memory_hits'] + metrics['stored_hits']) / lookups if lookups else 0.0
+        metrics['memory_entries'] = len(self.memory)
+        return metrics
+
+match_cache = MatchCache()
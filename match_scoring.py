@@ -0,0 +1,102 @@
+import os
+import re
+import numpy as np
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# How many search results to score per song, and the score a match needs
+MATCH_CANDIDATES = int(os.getenv('YTMUSIC_MATCH_CANDIDATES', '5'))
+MATCH_THRESHOLD = float(os.getenv('YTMUSIC_MATCH_THRESHOLD', '0.5'))
+
+WEIGHTS = {'title': 0.45, 'artist': 0.3, 'album': 0.1, 'duration': 0.15}
+VERSION_PENALTY = 0.3
+# Seconds of duration difference at which the duration score falls to 1/e
+DURATION_SCALE = 10.0
+
+# Title words marking a different recording of the same song
+VERSION_MARKERS = ('live', 'remix', 'cover', 'karaoke', 'instrumental', 'acoustic', 'demo',
+                   'sped', 'slowed', 'nightcore', 'reverb', 'remaster', 'mix', 'version', 'edit')
+_MARKER_BITS = {marker: 1 << i for i, marker in enumerate(VERSION_MARKERS)}
+
+_TOKEN = re.compile(r'\w+')
+
+def _features(text: str) -> Tuple[int, int, int]:
+    """128-bit token signature (as two words) and version marker bits of a text"""
+    low = high = markers = 0
+    for token in _TOKEN.findall(text.casefold()):
+        bit = hash(token) & 127
+        if bit < 64:
+            low |= 1 << bit
+        else:
+            high |= 1 << (bit - 64)
+        markers |= _MARKER_BITS.get(token, 0)
+    return low, high, markers
+
+def _popcount(words: np.ndarray) -> np.ndarray:
+    return np.unpackbits(words.view(np.uint8), axis=1).sum(axis=1)
+
+def _similarity(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Jaccard similarity of hashed token sets, row by row"""
+    union = _popcount(a | b)
+    return np.divide(_popcount(a & b), union, out=np.zeros(len(union)), where=union > 0)
+
+def _song_text(song: Dict[str, Any]) -> Tuple[str, str, str]:
+    artists = song.get('artists', [])
+    if isinstance(artists, str):
+        artists = [artists]
+    return (str(song.get('name', song.get('title', '')) or ''), ' '.join(artists),
+            str(song.get('album', '') or ''))
+
+def score_candidates(songs: Sequence[Dict[str, Any]],
+                     candidates: Sequence[Sequence[Dict[str, Any]]]) -> List[np.ndarray]:
+    """Score every candidate against its source song, all pairs in one batch.
+
+    Features are title, artist and album token similarity and closeness of
+    duration to the song's duration_ms; candidates whose title carries a
+    version marker (live, remix, cover, ...) the source title lacks are
+    penalized. Missing album or duration data scores neutral. Returns one
+    array of scores in [0, 1] per song, aligned with its candidates.
+    """
+    counts = np.array([len(group) for group in candidates], dtype=np.intp)
+    if not counts.sum():
+        return [np.zeros(0) for _ in candidates]
+    owner = np.repeat(np.arange(len(songs)), counts)
+
+    source = [[_features(text) for text in _song_text(song)] for song in songs]
+    found = [[_features(text) for text in _song_text(candidate)] for group in candidates for candidate in group]
+
+    def signatures(rows: List[List[Tuple[int, int, int]]], field: int) -> np.ndarray:
+        return np.array([row[field][:2] for row in rows], dtype=np.uint64).reshape(len(rows), 2)
+
+    title = _similarity(signatures(source, 0)[owner], signatures(found, 0))
+    artist = _similarity(signatures(source, 1)[owner], signatures(found, 1))
+
+    song_album = signatures(source, 2)[owner]
+    found_album = signatures(found, 2)
+    has_album = (song_album.any(axis=1)) & (found_album.any(axis=1))
+    album = np.where(has_album, _similarity(song_album, found_album), 0.5)
+
+    song_seconds = np.array([(song.get('duration_ms') or 0) / 1000 for song in songs])[owner]
+    found_seconds = np.array([candidate.get('duration') or 0 for group in candidates for candidate in group],
+                             dtype=float)
+    has_duration = (song_seconds > 0) & (found_seconds > 0)
+    duration = np.where(has_duration, np.exp(-np.abs(song_seconds - found_seconds) / DURATION_SCALE), 0.5)
+
+    song_markers = np.array([row[0][2] for row in source], dtype=np.int64)[owner]
+    found_markers = np.array([row[0][2] for row in found], dtype=np.int64)
+    version_mismatch = (found_markers & ~song_markers) != 0
+
+    scores = (WEIGHTS['title'] * title + WEIGHTS['artist'] * artist + WEIGHTS['album'] * album +
+              WEIGHTS['duration'] * duration - VERSION_PENALTY * version_mismatch)
+    scores = np.clip(scores, 0.0, 1.0)
+    return np.split(scores, np.cumsum(counts)[:-1])
+
+def pick_best(songs: Sequence[Dict[str, Any]], candidates: Sequence[Sequence[Dict[str, Any]]],
+              threshold: float = MATCH_THRESHOLD) -> List[Optional[Dict[str, Any]]]:
+    """The best-scoring candidate for each song, or None if none reaches threshold"""
+    best = []
+    for group, scores in zip(candidates, score_candidates(songs, candidates)):
+        if len(scores) and scores.max() >= threshold:
+            best.append(group[int(scores.argmax())])
+        else:
+            best.append(None)
+    return best
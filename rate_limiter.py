@@ -0,0 +1,162 @@
+import time
+import asyncio
+import threading
+import logging
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Hashable, Optional, Tuple
+
+class RateLimiter:
+    """Token bucket shared by every outbound request to one API.
+
+    Callers wait in per-key queues (one key per user) and tokens are handed
+    out round-robin across keys, so a user with thousands of queued calls
+    cannot starve one with a single call. A 429 pauses the whole bucket for
+    the advertised Retry-After and halves the refill rate; each success
+    then raises it again additively up to the configured ceiling.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None, min_rate: float = 1.0,
+                 recovery: Optional[float] = None):
+        self.max_rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self.recovery = recovery if recovery is not None else rate / 100
+
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._cond = threading.Condition()
+        self._waiting: Dict[Hashable, Deque[object]] = {}
+        self._turns: Deque[Hashable] = deque()
+        # Wake-up callbacks of tickets held by coroutines in acquire_async
+        self._wakers: Dict[object, Callable[[], Any]] = {}
+        self._stats = {'requests': 0, 'queued': 0, 'throttled': 0, 'retried': 0, 'wait_seconds': 0.0}
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _enqueue(self, key: Hashable) -> Tuple[Deque[object], object]:
+        ticket = object()
+        queue = self._waiting.get(key)
+        if queue is None:
+            queue = self._waiting[key] = deque()
+            self._turns.append(key)
+        queue.append(ticket)
+        return queue, ticket
+
+    def _dequeue(self, key: Hashable, queue: Deque[object], ticket: object) -> None:
+        """Give up the turn whether the ticket got a token or was interrupted"""
+        position = queue.index(ticket)
+        del queue[position]
+        if position == 0 and self._turns[0] == key:
+            self._turns.popleft()
+            if queue:
+                self._turns.append(key)
+        elif not queue:
+            self._turns.remove(key)
+        if not queue:
+            del self._waiting[key]
+        self._cond.notify_all()
+        if self._turns:
+            # Coroutines can't wait on the condition; wake the one whose turn is next
+            waker = self._wakers.get(self._waiting[self._turns[0]][0])
+            if waker is not None:
+                waker()
+
+    def _take(self, key: Hashable, queue: Deque[object], ticket: object) -> Optional[float]:
+        """Take a token for `ticket` and return 0, or return how long to wait
+        before trying again (None until another caller takes its turn)"""
+        now = time.monotonic()
+        self._refill(now)
+        if now < self._blocked_until:
+            return self._blocked_until - now
+        if self._tokens < 1:
+            return (1 - self._tokens) / self.rate
+        if self._turns[0] != key or queue[0] is not ticket:
+            # A token is free but it is another caller's turn
+            return None
+        self._tokens -= 1
+        return 0
+
+    def _record(self, start: float) -> float:
+        waited = time.monotonic() - start
+        self._stats['requests'] += 1
+        self._stats['wait_seconds'] += waited
+        if waited > 0.001:
+            self._stats['queued'] += 1
+        return waited
+
+    def acquire(self, key: Hashable = None) -> float:
+        """Block until `key` may send a request and return the seconds waited"""
+        start = time.monotonic()
+        with self._cond:
+            queue, ticket = self._enqueue(key)
+            try:
+                while True:
+                    timeout = self._take(key, queue, ticket)
+                    if timeout == 0:
+                        break
+                    self._cond.wait(timeout)
+            finally:
+                self._dequeue(key, queue, ticket)
+            return self._record(start)
+
+    async def acquire_async(self, key: Hashable = None) -> float:
+        """acquire() for coroutines, waiting on the event loop instead of blocking it"""
+        loop = asyncio.get_running_loop()
+        wake = asyncio.Event()
+        start = time.monotonic()
+        with self._cond:
+            queue, ticket = self._enqueue(key)
+            self._wakers[ticket] = lambda: loop.call_soon_threadsafe(wake.set)
+        try:
+            while True:
+                with self._cond:
+                    timeout = self._take(key, queue, ticket)
+                if timeout == 0:
+                    break
+                wake.clear()
+                try:
+                    await asyncio.wait_for(wake.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            with self._cond:
+                del self._wakers[ticket]
+                self._dequeue(key, queue, ticket)
+        with self._cond:
+            return self._record(start)
+
+    def throttled(self, retry_after: float) -> None:
+        """Record a 429: pause every caller and back off the refill rate"""
+        with self._cond:
+            now = time.monotonic()
+            # Requests already in flight when the limit hit will 429 too; back off once per pause
+            if now >= self._blocked_until:
+                self.rate = max(self.min_rate, self.rate / 2)
+            self._blocked_until = max(self._blocked_until, now + retry_after)
+            self._tokens = min(self._tokens, 0)
+            self._stats['throttled'] += 1
+            logging.warning(f"Throttled for {retry_after:.1f}s; request rate now {self.rate:.1f}/s")
+
+    def retried(self) -> None:
+        with self._cond:
+            self._stats['retried'] += 1
+
+    def succeeded(self) -> None:
+        """Record a successful call and let the rate recover towards the ceiling"""
+        with self._cond:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.recovery)
+
+    def metrics(self) -> Dict[str, Any]:
+        """Counters plus the current rate and queue depth"""
+        with self._cond:
+            metrics: Dict[str, Any] = dict(self._stats)
+            metrics['rate'] = self.rate
+            metrics['waiting'] = sum(len(queue) for queue in self._waiting.values())
+            metrics['waiting_keys'] = len(self._waiting)
+            metrics['blocked_for'] = max(0.0, self._blocked_until - time.monotonic())
+            return metrics
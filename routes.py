@@ -5,17 +5,19 @@ from app import app
 from database import (
     get_user_by_email, get_user_by_id, create_user, get_user_accounts,
     get_playlists_by_account, create_playlist, get_playlist_songs,
-    create_sync_log, get_platform_by_name, add_song_to_playlist,
-    get_or_create_song, add_platform_song, db
+    create_sync_log, get_platform_by_name, add_song_to_playlist, db
 )
 from spotify_auth import (
     get_spotify_auth_url, exchange_code_for_token, link_spotify_account,
-    get_user_playlists, get_playlist_tracks
+    get_user_playlists, get_playlist_tracks, track_cache, get_account_token, token_manager
 )
+from spotify_client import get_spotify_client
 from youtube_music import (
-    link_youtube_music_account, get_public_playlists, setup_ytmusic,
-    sync_to_youtube_music
+    link_youtube_music_account, get_public_playlists_cached, public_playlists, sync_to_youtube_music,
+    search_metrics
 )
+from ytmusic_pool import get_ytmusic_pool
+from match_cache import match_cache
 
 @app.route('/')
 def index():
@@ -146,7 +148,8 @@ def manual_oauth():
             return redirect(url_for('test_oauth'))
         
         # Link account
-        if link_spotify_account(int(user_id), token_data['access_token']):
+        if link_spotify_account(int(user_id), token_data['access_token'],
+                                token_data.get('refresh_token'), token_data.get('expires_in')):
             flash('Spotify account linked successfully!', 'success')
             return redirect(url_for('index'))
         else:
@@ -193,7 +196,8 @@ def spotify_callback():
         return redirect(url_for('index'))
     
     # Link account
-    if link_spotify_account(user_id, token_data['access_token']):
+    if link_spotify_account(user_id, token_data['access_token'],
+                            token_data.get('refresh_token'), token_data.get('expires_in')):
         logging.info("Spotify account linked successfully")
         flash('Spotify account linked successfully', 'success')
     else:
@@ -202,6 +206,33 @@ def spotify_callback():
     
     return redirect(url_for('index'))
 
+@app.route('/api/spotify/metrics')
+def spotify_metrics():
+    """Outbound Spotify request, track cache and token refresh counters"""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Not logged in'}), 401
+    
+    return jsonify({
+        'success': True,
+        'metrics': get_spotify_client().metrics(),
+        'track_cache': track_cache.metrics(),
+        'tokens': token_manager.metrics()
+    })
+
+@app.route('/api/youtube-music/metrics')
+def youtube_music_metrics():
+    """YouTube Music client pool, cache and search coalescing counters"""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'Not logged in'}), 401
+    
+    return jsonify({
+        'success': True,
+        'pool': get_ytmusic_pool().metrics(),
+        'match_cache': match_cache.metrics(),
+        'searches': search_metrics(),
+        'public_playlists': public_playlists.metrics()
+    })
+
 @app.route('/link-youtube-music', methods=['POST'])
 def link_youtube_music():
     """Link YouTube Music account (public access)"""
@@ -240,7 +271,7 @@ def playlists():
             try:
                 spotify_platform = get_platform_by_name('Spotify')
                 if spotify_platform and account['platform_id'] == spotify_platform['platform_id']:
-                    spotify_playlists = get_user_playlists(account['auth_token'])
+                    spotify_playlists = get_user_playlists(get_account_token(account))
                     for playlist in spotify_playlists:
                         playlists_data.append({
                             'id': playlist['id'],
@@ -257,18 +288,16 @@ def playlists():
             try:
                 youtube_platform = get_platform_by_name('YouTube Music')
                 if youtube_platform and account['platform_id'] == youtube_platform['platform_id']:
-                    ytmusic = setup_ytmusic()
-                    if ytmusic:
-                        yt_playlists = get_public_playlists(ytmusic, "Popular Music")
-                        for playlist in yt_playlists[:10]:  # Limit to 10 public playlists
-                            playlists_data.append({
-                                'id': playlist['playlistId'],
-                                'name': playlist['title'],
-                                'description': playlist.get('description', ''),
-                                'track_count': playlist.get('trackCount', 0),
-                                'platform': 'YouTube Music',
-                                'account_id': account['account_id']
-                            })
+                    yt_playlists = get_public_playlists_cached("Popular Music")
+                    for playlist in yt_playlists[:10]:  # Limit to 10 public playlists
+                        playlists_data.append({
+                            'id': playlist['playlistId'],
+                            'name': playlist['title'],
+                            'description': playlist.get('description', ''),
+                            'track_count': playlist.get('trackCount', 0),
+                            'platform': 'YouTube Music',
+                            'account_id': account['account_id']
+                        })
             except Exception as e:
                 logging.error(f"Error fetching YouTube Music playlists: {e}")
     
@@ -320,7 +349,7 @@ def api_sync():
         # Get tracks from source platform
         if spotify_platform and source_account['platform_id'] == spotify_platform['platform_id']:
             # Get tracks from Spotify
-            spotify_tracks = get_playlist_tracks(source_account['auth_token'], playlist_id)
+            spotify_tracks = get_playlist_tracks(get_account_token(source_account), playlist_id)
             songs = [{
                 'name': track['name'],
                 'artists': track['artists'],
@@ -337,30 +366,11 @@ def api_sync():
         # Sync to destination platform
         if youtube_platform and dest_account['platform_id'] == youtube_platform['platform_id']:
             # Sync to YouTube Music (search and match)
+            # Matching stores new songs and their YouTube Music mappings itself, see match_cache
             sync_result = sync_to_youtube_music(songs)
             if sync_result['success']:
                 songs_added = sync_result['total_found']
                 songs_not_found = sync_result['total_not_found']
-                
-                # Store songs in database
-                for found_song_data in sync_result['found_songs']:
-                    original_song = found_song_data['original']
-                    youtube_song = found_song_data['youtube_music']
-                    
-                    # Create/get song record
-                    song_id = get_or_create_song(
-                        title=original_song['name'],
-                        artist=', '.join(original_song['artists']),
-                        album=original_song['album'],
-                        duration=original_song.get('duration_ms', 0) // 1000
-                    )
-                    
-                    # Add platform song mapping for YouTube Music
-                    add_platform_song(
-                        song_id=song_id,
-                        platform_id=youtube_platform['platform_id'],
-                        platform_specific_id=youtube_song['videoId']
-                    )
             else:
                 return jsonify({'success': False, 'error': sync_result.get('error', 'Sync failed')}), 500
         
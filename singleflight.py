@@ -0,0 +1,57 @@
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+class SingleFlight:
+    """Collapse concurrent calls for the same key into one execution.
+
+    The first caller for a key runs the function; callers arriving while it
+    is in flight wait and receive the same result (or exception). Nothing
+    is cached once the call completes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self._stats = {'calls': 0, 'executions': 0, 'shared': 0}
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            self._stats['calls'] += 1
+            call = self._calls.get(key)
+            if call is not None:
+                self._stats['shared'] += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self._stats['executions'] += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def metrics(self) -> Dict[str, int]:
+        """Calls made, functions actually executed and calls that shared a result"""
+        with self._lock:
+            return dict(self._stats)
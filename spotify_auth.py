@@ -1,10 +1,17 @@
 import os
+import asyncio
+import httpx
 import requests
 import base64
 import urllib.parse
+import time
 import logging
-from typing import Optional, Dict, Any, List
-from database import db, get_platform_by_name, create_user_platform_account, get_user_accounts
+from typing import Optional, Dict, Any, List, Callable
+from database import get_platform_by_name, create_user_platform_account, get_user_accounts, update_account_tokens
+from spotify_client import get_spotify_client
+from async_bridge import run_sync
+from cache import LRUCache
+from token_manager import TokenManager, token_expiry
 
 # Spotify API configuration
 SPOTIFY_CLIENT_ID = os.getenv('SPOTIFY_CLIENT_ID', '6ebe47c28c0c462a9465a17a8c337e4e')
@@ -12,8 +19,22 @@ SPOTIFY_CLIENT_SECRET = os.getenv('SPOTIFY_CLIENT_SECRET', '8647e906b0624e168236
 REDIRECT_URI = os.getenv('REDIRECT_URI', 'https://synctunes--1754663549838-start-application.replit.app/api/spotify/callback')
 
 SPOTIFY_AUTH_URL = 'https://accounts.spotify.com/authorize'
-SPOTIFY_TOKEN_URL = 'https://accounts.spotify.com/api/token'
-SPOTIFY_API_URL = 'https://api.spotify.com/v1'
+SPOTIFY_TOKEN_URL = os.getenv('SPOTIFY_TOKEN_URL', 'https://accounts.spotify.com/api/token')
+SPOTIFY_API_URL = os.getenv('SPOTIFY_API_URL', 'https://api.spotify.com/v1')
+
+# Upper bound on concurrent page requests for a single paginated listing
+PAGE_FETCH_WORKERS = int(os.getenv('SPOTIFY_PAGE_WORKERS', '8'))
+
+# Only the parts of a playlist item get_playlist_tracks keeps; everything else is left on the server
+TRACK_FIELDS = 'total,next,items(track(type,id,name,duration_ms,artists(name),album(name)))'
+
+# Chunked playlist writes: Spotify accepts at most 100 URIs per request
+ADD_TRACKS_CHUNK_SIZE = 100
+ADD_TRACKS_MAX_RETRIES = int(os.getenv('SPOTIFY_ADD_TRACKS_RETRIES', '3'))
+ADD_TRACKS_BACKOFF = 0.5
+
+# Normalized track lists keyed by (playlist_id, snapshot_id), bounded by total tracks held
+track_cache = LRUCache(int(os.getenv('SPOTIFY_TRACK_CACHE_TRACKS', '200000')), sizeof=len)
 
 def get_spotify_auth_url(state: str = "") -> str:
     """Get Spotify authorization URL"""
@@ -33,16 +54,20 @@ def get_spotify_auth_url(state: str = "") -> str:
     logging.info(f"DEBUG: Using redirect URI: {REDIRECT_URI}")
     return f"{SPOTIFY_AUTH_URL}?{urllib.parse.urlencode(params)}"
 
-def exchange_code_for_token(code: str) -> Optional[Dict[str, Any]]:
-    """Exchange authorization code for access token"""
+def _token_request_headers() -> Dict[str, str]:
+    """Client credentials headers for the Spotify token endpoint"""
     auth_string = f"{SPOTIFY_CLIENT_ID}:{SPOTIFY_CLIENT_SECRET}"
     auth_bytes = auth_string.encode('utf-8')
     auth_base64 = base64.b64encode(auth_bytes).decode('utf-8')
     
-    headers = {
+    return {
         'Authorization': f'Basic {auth_base64}',
         'Content-Type': 'application/x-www-form-urlencoded'
     }
+
+def exchange_code_for_token(code: str) -> Optional[Dict[str, Any]]:
+    """Exchange authorization code for access token"""
+    headers = _token_request_headers()
     
     # Debug logging
     logging.info(f"Token exchange - Client ID: {SPOTIFY_CLIENT_ID}")
@@ -58,7 +83,7 @@ def exchange_code_for_token(code: str) -> Optional[Dict[str, Any]]:
     try:
         logging.info(f"Sending token request to: {SPOTIFY_TOKEN_URL}")
         logging.info(f"Request data: {data}")
-        response = requests.post(SPOTIFY_TOKEN_URL, headers=headers, data=data)
+        response = get_spotify_client().post(SPOTIFY_TOKEN_URL, headers=headers, data=data)
         
         # Log the response for debugging
         logging.info(f"Response status: {response.status_code}")
@@ -73,74 +98,163 @@ def exchange_code_for_token(code: str) -> Optional[Dict[str, Any]]:
             logging.error(f"Error response: {e.response.text}")
         return None
 
+def refresh_access_token(refresh_token: str) -> Optional[Dict[str, Any]]:
+    """Exchange a refresh token for a new access token"""
+    data = {
+        'grant_type': 'refresh_token',
+        'refresh_token': refresh_token
+    }
+    
+    try:
+        response = get_spotify_client().post(SPOTIFY_TOKEN_URL, headers=_token_request_headers(), data=data)
+        response.raise_for_status()
+        return response.json()
+    except requests.RequestException as e:
+        logging.error(f"Error refreshing access token: {e}")
+        return None
+
+token_manager = TokenManager(refresh_access_token)
+get_spotify_client().unauthorized_handler = token_manager.handle_unauthorized
+get_spotify_client().token_resolver = token_manager.current_token
+
+def get_account_token(account: Dict[str, Any]) -> str:
+    """Get a usable access token for a linked Spotify account, refreshing it if needed"""
+    return token_manager.get_access_token(account)
+
 def get_user_profile(access_token: str) -> Optional[Dict[str, Any]]:
     """Get Spotify user profile"""
-    headers = {'Authorization': f'Bearer {access_token}'}
-    
     try:
-        response = requests.get(f"{SPOTIFY_API_URL}/me", headers=headers)
+        response = get_spotify_client().get(f"{SPOTIFY_API_URL}/me", access_token)
         response.raise_for_status()
         return response.json()
     except requests.RequestException as e:
         print(f"Error getting user profile: {e}")
         return None
 
-def get_user_playlists(access_token: str) -> List[Dict[str, Any]]:
+async def _fetch_pages(access_token: str, url: str, limit: int, parallel: bool = True,
+                       params: Optional[Dict[str, Any]] = None,
+                       transform: Optional[Callable[[Dict[str, Any]], Any]] = None) -> List[Any]:
+    """Every page of a Spotify paging object, in order.
+
+    The first page reports `total`, so in parallel mode the remaining
+    offsets are requested concurrently on the event loop, at most
+    PAGE_FETCH_WORKERS at a time. Sequential mode requests one page at a
+    time until there is no `next` page.
+    `transform` runs on each decoded page as it arrives, so only its
+    result is kept while later pages are still in flight.
+    """
+    client = get_spotify_client()
+    params = dict(params or {}, limit=limit)
+    transform = transform or (lambda page: page)
+
+    async def fetch(offset: int) -> Dict[str, Any]:
+        response = await client.get_async(url, access_token, params=dict(params, offset=offset))
+        response.raise_for_status()
+        return response.json()
+
+    first = await fetch(0)
+    pages = [transform(first)]
+
+    if not parallel:
+        # Walk offsets rather than the `next` links so the same params apply to every page
+        next_url = first.get('next')
+        offset = limit
+        while next_url:
+            page = await fetch(offset)
+            next_url = page.get('next')
+            offset += limit
+            pages.append(transform(page))
+        return pages
+
+    semaphore = asyncio.Semaphore(PAGE_FETCH_WORKERS)
+
+    async def fetch_page(offset: int) -> Any:
+        async with semaphore:
+            return transform(await fetch(offset))
+
+    pages.extend(await asyncio.gather(*(fetch_page(offset)
+                                        for offset in range(limit, first.get('total') or 0, limit))))
+    return pages
+
+async def get_user_playlists_async(access_token: str, parallel: bool = True) -> List[Dict[str, Any]]:
     """Get user's Spotify playlists"""
-    headers = {'Authorization': f'Bearer {access_token}'}
-    playlists = []
-    url = f"{SPOTIFY_API_URL}/me/playlists?limit=50"
-    
     try:
-        while url:
-            response = requests.get(url, headers=headers)
-            response.raise_for_status()
-            data = response.json()
-            playlists.extend(data.get('items', []))
-            url = data.get('next')
-        
-        return playlists
-    except requests.RequestException as e:
+        pages = await _fetch_pages(access_token, f"{SPOTIFY_API_URL}/me/playlists", 50, parallel)
+        return [playlist for page in pages for playlist in page.get('items', [])]
+    except (httpx.HTTPError, ValueError) as e:
         print(f"Error getting playlists: {e}")
         return []
 
-def get_playlist_tracks(access_token: str, playlist_id: str) -> List[Dict[str, Any]]:
-    """Get tracks from a Spotify playlist"""
-    headers = {'Authorization': f'Bearer {access_token}'}
+def get_user_playlists(access_token: str, parallel: bool = True) -> List[Dict[str, Any]]:
+    """Get user's Spotify playlists"""
+    return run_sync(get_user_playlists_async(access_token, parallel))
+
+async def get_playlist_snapshot_async(access_token: str, playlist_id: str) -> Optional[str]:
+    """Get the current snapshot_id of a Spotify playlist"""
+    try:
+        response = await get_spotify_client().get_async(f"{SPOTIFY_API_URL}/playlists/{playlist_id}",
+                                                        access_token, params={'fields': 'snapshot_id'})
+        response.raise_for_status()
+        return response.json().get('snapshot_id')
+    except (httpx.HTTPError, ValueError) as e:
+        print(f"Error getting playlist snapshot: {e}")
+        return None
+
+def get_playlist_snapshot(access_token: str, playlist_id: str) -> Optional[str]:
+    """Get the current snapshot_id of a Spotify playlist"""
+    return run_sync(get_playlist_snapshot_async(access_token, playlist_id))
+
+def _normalize_tracks(page: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Reduce a page of playlist items to the track fields the app uses"""
     tracks = []
-    url = f"{SPOTIFY_API_URL}/playlists/{playlist_id}/tracks?limit=100"
+    for item in page.get('items') or []:
+        track = item.get('track')
+        if track and track.get('type') == 'track':
+            tracks.append({
+                'id': track['id'],
+                'name': track['name'],
+                'artists': [artist['name'] for artist in track['artists']],
+                'album': track['album']['name'],
+                'duration_ms': track.get('duration_ms', 0)
+            })
+    return tracks
+
+async def get_playlist_tracks_async(access_token: str, playlist_id: str, parallel: bool = True,
+                                    snapshot_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Get tracks from a Spotify playlist.
+
+    Track lists are cached per playlist version. Pass the snapshot_id from
+    a playlist listing to skip the network entirely on a hit; otherwise a
+    metadata call fetches it first.
+    """
+    if snapshot_id is None:
+        snapshot_id = await get_playlist_snapshot_async(access_token, playlist_id)
+    if snapshot_id is not None:
+        cached = track_cache.get((playlist_id, snapshot_id))
+        if cached is not None:
+            return list(cached)
+    
+    url = f"{SPOTIFY_API_URL}/playlists/{playlist_id}/tracks"
+    params = {'fields': TRACK_FIELDS} if TRACK_FIELDS else None
     
     try:
-        while url:
-            response = requests.get(url, headers=headers)
-            response.raise_for_status()
-            data = response.json()
-            
-            for item in data.get('items', []):
-                track = item.get('track')
-                if track and track.get('type') == 'track':
-                    tracks.append({
-                        'id': track['id'],
-                        'name': track['name'],
-                        'artists': [artist['name'] for artist in track['artists']],
-                        'album': track['album']['name'],
-                        'duration_ms': track.get('duration_ms', 0)
-                    })
-            
-            url = data.get('next')
+        pages = await _fetch_pages(access_token, url, 100, parallel, params, _normalize_tracks)
+        tracks = [track for page in pages for track in page]
         
-        return tracks
-    except requests.RequestException as e:
+        if snapshot_id is not None:
+            track_cache.put((playlist_id, snapshot_id), tracks)
+        return list(tracks)
+    except (httpx.HTTPError, ValueError) as e:
         print(f"Error getting playlist tracks: {e}")
         return []
 
+def get_playlist_tracks(access_token: str, playlist_id: str, parallel: bool = True,
+                        snapshot_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Get tracks from a Spotify playlist; see get_playlist_tracks_async"""
+    return run_sync(get_playlist_tracks_async(access_token, playlist_id, parallel, snapshot_id))
+
 def create_playlist(access_token: str, user_id: str, name: str, description: str = "") -> Optional[Dict[str, Any]]:
     """Create a new Spotify playlist"""
-    headers = {
-        'Authorization': f'Bearer {access_token}',
-        'Content-Type': 'application/json'
-    }
-    
     data = {
         'name': name,
         'description': description,
@@ -148,41 +262,102 @@ def create_playlist(access_token: str, user_id: str, name: str, description: str
     }
     
     try:
-        response = requests.post(f"{SPOTIFY_API_URL}/users/{user_id}/playlists", 
-                               headers=headers, json=data)
+        response = get_spotify_client().post(f"{SPOTIFY_API_URL}/users/{user_id}/playlists",
+                                             access_token, json=data)
         response.raise_for_status()
         return response.json()
     except requests.RequestException as e:
         print(f"Error creating playlist: {e}")
         return None
 
-def add_tracks_to_playlist(access_token: str, playlist_id: str, track_uris: List[str]) -> bool:
-    """Add tracks to a Spotify playlist"""
-    headers = {
-        'Authorization': f'Bearer {access_token}',
-        'Content-Type': 'application/json'
-    }
-    
-    # Spotify allows max 100 tracks per request
-    chunk_size = 100
+def _playlist_length(access_token: str, playlist_id: str) -> int:
+    """Current number of items in a Spotify playlist"""
+    response = get_spotify_client().get(f"{SPOTIFY_API_URL}/playlists/{playlist_id}", access_token,
+                                        params={'fields': 'tracks.total'})
+    response.raise_for_status()
+    return response.json().get('tracks', {}).get('total', 0)
+
+def write_playlist_tracks(access_token: str, playlist_id: str, track_uris: List[str],
+                          checkpoint: Optional[Dict[str, Any]] = None,
+                          position: Optional[int] = None) -> Dict[str, Any]:
+    """Add tracks to a Spotify playlist in chunks, resumably.
+
+    Every chunk is inserted at an explicit position (`position`, or the
+    playlist's length when the write starts), so the returned checkpoint
+    records exactly how many URIs have landed and where the next chunk
+    goes. Passing it back resumes after the last confirmed chunk. A failed
+    chunk is retried with backoff, but first the playlist length is checked
+    in case the failed request was applied anyway, so chunks are never
+    written twice. Chunks are sent one at a time: Spotify applies
+    position-addressed inserts in arrival order, so concurrent chunks could
+    not keep insertion order.
+    """
+    if checkpoint is None:
+        checkpoint = {
+            'playlist_id': playlist_id,
+            'total': len(track_uris),
+            'position': position,
+            'written': 0,
+            'snapshot_id': None,
+            'complete': False,
+            'error': None
+        }
+    checkpoint['error'] = None
+    client = get_spotify_client()
+    url = f"{SPOTIFY_API_URL}/playlists/{playlist_id}/tracks"
     
     try:
-        for i in range(0, len(track_uris), chunk_size):
-            chunk = track_uris[i:i + chunk_size]
-            data = {'uris': chunk}
+        if checkpoint['position'] is None:
+            checkpoint['position'] = _playlist_length(access_token, playlist_id)
+        
+        while checkpoint['written'] < len(track_uris):
+            chunk = track_uris[checkpoint['written']:checkpoint['written'] + ADD_TRACKS_CHUNK_SIZE]
+            insert_at = checkpoint['position'] + checkpoint['written']
+            
+            for attempt in range(ADD_TRACKS_MAX_RETRIES + 1):
+                if attempt:
+                    time.sleep(ADD_TRACKS_BACKOFF * 2 ** (attempt - 1))
+                    # The earlier attempt may have been applied even though we saw an error
+                    if _playlist_length(access_token, playlist_id) >= insert_at + len(chunk):
+                        break
+                try:
+                    response = client.post(url, access_token, json={'uris': chunk, 'position': insert_at})
+                except requests.RequestException as e:
+                    logging.warning(f"Adding tracks at {insert_at} to {playlist_id} failed: {e}")
+                    continue
+                if response.status_code < 500:
+                    response.raise_for_status()
+                    checkpoint['snapshot_id'] = response.json().get('snapshot_id')
+                    break
+                logging.warning(f"Adding tracks at {insert_at} to {playlist_id} failed: {response.status_code}")
+            else:
+                raise requests.RequestException(f"chunk at position {insert_at} failed "
+                                                f"after {ADD_TRACKS_MAX_RETRIES} retries")
             
-            response = requests.post(f"{SPOTIFY_API_URL}/playlists/{playlist_id}/tracks",
-                                   headers=headers, json=data)
-            response.raise_for_status()
+            checkpoint['written'] += len(chunk)
         
-        return True
+        checkpoint['complete'] = True
     except requests.RequestException as e:
         print(f"Error adding tracks to playlist: {e}")
-        return False
+        checkpoint['error'] = str(e)
+    
+    return checkpoint
 
-def search_track(access_token: str, query: str) -> Optional[Dict[str, Any]]:
+# Unfinished writes from add_tracks_to_playlist, so a re-run resumes instead of duplicating
+_pending_writes = LRUCache(256)
+
+def add_tracks_to_playlist(access_token: str, playlist_id: str, track_uris: List[str]) -> bool:
+    """Add tracks to a Spotify playlist"""
+    key = (playlist_id, hash(tuple(track_uris)))
+    checkpoint = write_playlist_tracks(access_token, playlist_id, track_uris, _pending_writes.get(key))
+    if checkpoint['complete']:
+        _pending_writes.pop(key)
+    else:
+        _pending_writes.put(key, checkpoint)
+    return checkpoint['complete']
+
+async def search_track_async(access_token: str, query: str) -> Optional[Dict[str, Any]]:
     """Search for a track on Spotify"""
-    headers = {'Authorization': f'Bearer {access_token}'}
     params = {
         'q': query,
         'type': 'track',
@@ -190,17 +365,22 @@ def search_track(access_token: str, query: str) -> Optional[Dict[str, Any]]:
     }
     
     try:
-        response = requests.get(f"{SPOTIFY_API_URL}/search", headers=headers, params=params)
+        response = await get_spotify_client().get_async(f"{SPOTIFY_API_URL}/search", access_token, params=params)
         response.raise_for_status()
         data = response.json()
         
         tracks = data.get('tracks', {}).get('items', [])
         return tracks[0] if tracks else None
-    except requests.RequestException as e:
+    except (httpx.HTTPError, ValueError) as e:
         print(f"Error searching track: {e}")
         return None
 
-def link_spotify_account(user_id: int, access_token: str) -> bool:
+def search_track(access_token: str, query: str) -> Optional[Dict[str, Any]]:
+    """Search for a track on Spotify"""
+    return run_sync(search_track_async(access_token, query))
+
+def link_spotify_account(user_id: int, access_token: str, refresh_token: Optional[str] = None,
+                         expires_in: Optional[int] = None) -> bool:
     """Link Spotify account to user"""
     # Get user profile
     profile = get_user_profile(access_token)
@@ -212,15 +392,15 @@ def link_spotify_account(user_id: int, access_token: str) -> bool:
     if not spotify_platform:
         return False
     
+    expires_at = token_expiry(expires_in)
+    
     # Check if account already linked
     existing_accounts = get_user_accounts(user_id)
     for account in existing_accounts:
         if (account['platform_id'] == spotify_platform['platform_id'] and 
             account['username_on_platform'] == profile['id']):
-            # Update token
-            db.update('UserPlatformAccount', 
-                     {'auth_token': access_token},
-                     {'account_id': account['account_id']})
+            # Update tokens
+            update_account_tokens(account['account_id'], access_token, refresh_token, expires_at)
             return True
     
     # Create new account link
@@ -228,7 +408,9 @@ def link_spotify_account(user_id: int, access_token: str) -> bool:
         user_id=user_id,
         platform_id=spotify_platform['platform_id'],
         username=profile['id'],
-        auth_token=access_token
+        auth_token=access_token,
+        refresh_token=refresh_token,
+        token_expires_at=expires_at
     )
     
     return True
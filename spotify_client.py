@@ -0,0 +1,209 @@
+import os
+import asyncio
+import threading
+import logging
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from typing import Optional, Dict, Any, Callable, Union
+from rate_limiter import RateLimiter
+from async_bridge import run_sync, to_thread
+
+# Connection tuning for outbound Spotify calls
+CONNECT_TIMEOUT = float(os.getenv('SPOTIFY_CONNECT_TIMEOUT', '3.05'))
+READ_TIMEOUT = float(os.getenv('SPOTIFY_READ_TIMEOUT', '10'))
+POOL_SIZE = int(os.getenv('SPOTIFY_POOL_SIZE', '32'))
+
+# Process-wide request budget; the limiter backs off below this when Spotify returns 429
+RATE_LIMIT = float(os.getenv('SPOTIFY_RATE_LIMIT', '30'))
+RATE_BURST = float(os.getenv('SPOTIFY_RATE_BURST', str(RATE_LIMIT)))
+MAX_THROTTLE_RETRIES = int(os.getenv('SPOTIFY_MAX_THROTTLE_RETRIES', '3'))
+DEFAULT_RETRY_AFTER = 1.0
+
+def _retry_after(response: Union[requests.Response, httpx.Response]) -> float:
+    """Seconds to wait from a 429 response's Retry-After header"""
+    try:
+        return max(0.0, float(response.headers.get('Retry-After', DEFAULT_RETRY_AFTER)))
+    except ValueError:
+        return DEFAULT_RETRY_AFTER
+
+class SpotifyClient:
+    """Shared HTTP client for the Spotify Accounts and Web APIs.
+
+    One requests.Session keeps TLS connections alive in a pool sized for
+    the app's worker threads, so paginated fetches and per-track searches
+    reuse warm connections. Every call gets connect/read timeouts, and
+    failed connects are retried briefly before surfacing.
+
+    Calls are scheduled through a shared RateLimiter keyed by access token,
+    so capacity is split fairly between users, and a 429 pauses everyone
+    for Retry-After before the request is retried.
+
+    request_async() is the same call for coroutines on the shared event
+    loop, sent through an httpx.AsyncClient. Requests waiting on the
+    network there hold no thread, so one loop can keep many lookups in
+    flight while sharing the limiter and token refresh with the blocking
+    calls.
+    """
+
+    def __init__(self, pool_size: int = POOL_SIZE,
+                 connect_timeout: float = CONNECT_TIMEOUT, read_timeout: float = READ_TIMEOUT,
+                 limiter: Optional[RateLimiter] = None, max_throttle_retries: int = MAX_THROTTLE_RETRIES):
+        self.timeout = (connect_timeout, read_timeout)
+        self.limiter = limiter or RateLimiter(RATE_LIMIT, RATE_BURST)
+        self.max_throttle_retries = max_throttle_retries
+        # Called with a rejected access token on 401; returns a replacement to retry with
+        self.unauthorized_handler: Optional[Callable[[str], Optional[str]]] = None
+        # Called with an access token before each send; returns the token that replaced it, if any
+        self.token_resolver: Optional[Callable[[str], str]] = None
+        self.session = requests.Session()
+        self.session.headers.update({
+            'Accept': 'application/json',
+            'Accept-Encoding': 'gzip, deflate',
+            'Connection': 'keep-alive'
+        })
+        # Only connection setup is retried here; 429s are left to the rate limiter
+        retry = Retry(total=2, connect=2, read=0, status=0, backoff_factor=0.2,
+                      allowed_methods=None, respect_retry_after_header=False, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.pool_size = pool_size
+        self._async_session: Optional[httpx.AsyncClient] = None
+        self._async_slots: Optional[asyncio.Semaphore] = None
+
+    def request(self, method: str, url: str, access_token: Optional[str] = None,
+                **kwargs: Any) -> requests.Response:
+        """Send a request, adding the bearer token and default timeouts.
+
+        Waits for the rate limiter first and retries after 429 responses up
+        to max_throttle_retries times; the last 429 is returned to the caller.
+        A 401 is retried once with the token from unauthorized_handler, and
+        a token that token_resolver reports as already replaced is swapped
+        for its successor before sending.
+        """
+        headers: Dict[str, str] = dict(kwargs.pop('headers', None) or {})
+        if access_token:
+            headers['Authorization'] = f'Bearer {access_token}'
+        kwargs.setdefault('timeout', self.timeout)
+
+        attempt = 0
+        reauthorized = False
+        while True:
+            if access_token and self.token_resolver:
+                # Pages queued before a refresh would otherwise each earn a 401
+                current = self.token_resolver(access_token)
+                if current != access_token:
+                    access_token = current
+                    headers['Authorization'] = f'Bearer {access_token}'
+            self.limiter.acquire(access_token)
+            response = self.session.request(method, url, headers=headers, **kwargs)
+            if response.status_code == 401 and access_token and self.unauthorized_handler and not reauthorized:
+                reauthorized = True
+                new_token = self.unauthorized_handler(access_token)
+                if new_token:
+                    access_token = new_token
+                    headers['Authorization'] = f'Bearer {access_token}'
+                    response.close()
+                    continue
+            if response.status_code != 429:
+                self.limiter.succeeded()
+                return response
+
+            retry_after = _retry_after(response)
+            self.limiter.throttled(retry_after)
+            if attempt >= self.max_throttle_retries:
+                logging.error(f"Giving up on {method} {url} after {attempt} throttled retries")
+                return response
+            attempt += 1
+            self.limiter.retried()
+            response.close()
+
+    def _async_client(self) -> httpx.AsyncClient:
+        # Created on first use from the shared event loop, which then owns its connections
+        if self._async_session is None:
+            # Coroutines past pool_size wait here rather than in httpx's pool,
+            # whose bookkeeping costs grow with the number of waiters
+            self._async_slots = asyncio.Semaphore(self.pool_size)
+            self._async_session = httpx.AsyncClient(
+                headers={'Accept': 'application/json', 'Accept-Encoding': 'gzip, deflate'},
+                timeout=httpx.Timeout(self.timeout[1], connect=self.timeout[0]),
+                # Like the blocking session, only failed connects are retried
+                transport=httpx.AsyncHTTPTransport(retries=2, limits=httpx.Limits(
+                    max_connections=self.pool_size, max_keepalive_connections=self.pool_size)))
+        return self._async_session
+
+    async def request_async(self, method: str, url: str, access_token: Optional[str] = None,
+                            **kwargs: Any) -> httpx.Response:
+        """request() for coroutines on the async_bridge event loop.
+
+        The rate limiter is awaited instead of blocking the loop, and the
+        401 handler, which may call the token endpoint, runs on the I/O
+        executor. Keyword arguments are httpx's (params, json, data...).
+        """
+        headers: Dict[str, str] = dict(kwargs.pop('headers', None) or {})
+        if access_token:
+            headers['Authorization'] = f'Bearer {access_token}'
+        client = self._async_client()
+
+        attempt = 0
+        reauthorized = False
+        while True:
+            if access_token and self.token_resolver:
+                current = self.token_resolver(access_token)
+                if current != access_token:
+                    access_token = current
+                    headers['Authorization'] = f'Bearer {access_token}'
+            await self.limiter.acquire_async(access_token)
+            async with self._async_slots:
+                response = await client.request(method, url, headers=headers, **kwargs)
+            if response.status_code == 401 and access_token and self.unauthorized_handler and not reauthorized:
+                reauthorized = True
+                new_token = await to_thread(self.unauthorized_handler, access_token)
+                if new_token:
+                    access_token = new_token
+                    headers['Authorization'] = f'Bearer {access_token}'
+                    continue
+            if response.status_code != 429:
+                self.limiter.succeeded()
+                return response
+
+            retry_after = _retry_after(response)
+            self.limiter.throttled(retry_after)
+            if attempt >= self.max_throttle_retries:
+                logging.error(f"Giving up on {method} {url} after {attempt} throttled retries")
+                return response
+            attempt += 1
+            self.limiter.retried()
+
+    def get(self, url: str, access_token: Optional[str] = None, **kwargs: Any) -> requests.Response:
+        return self.request('GET', url, access_token, **kwargs)
+
+    async def get_async(self, url: str, access_token: Optional[str] = None, **kwargs: Any) -> httpx.Response:
+        return await self.request_async('GET', url, access_token, **kwargs)
+
+    def post(self, url: str, access_token: Optional[str] = None, **kwargs: Any) -> requests.Response:
+        return self.request('POST', url, access_token, **kwargs)
+
+    def metrics(self) -> Dict[str, Any]:
+        """Scheduler counters: requests, queued, throttled, retried, current rate"""
+        return self.limiter.metrics()
+
+    def close(self) -> None:
+        self.session.close()
+        if self._async_session is not None:
+            run_sync(self._async_session.aclose())
+            self._async_session = None
+
+_client: Optional[SpotifyClient] = None
+_client_lock = threading.Lock()
+
+def get_spotify_client() -> SpotifyClient:
+    """Return the process-wide Spotify client, creating it on first use"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = SpotifyClient()
+    return _client
@@ -0,0 +1,365 @@
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Dict, Iterator, List, Optional, Any, Tuple
+
+from database import (
+    StorageEngine, IntegrityError, PRIMARY_KEYS, DEFAULT_INDEXES, DEFAULT_UNIQUE_KEYS
+)
+
+# Column definitions for every table, primary keys excluded
+SCHEMA = {
+    'User_': [('name', 'TEXT'), ('email', 'TEXT'), ('password', 'TEXT')],
+    'Admin': [('name', 'TEXT'), ('email', 'TEXT'), ('password', 'TEXT')],
+    'Platform': [('platform_name', 'TEXT'), ('api_details', 'TEXT')],
+    'UserPlatformAccount': [
+        ('user_id', 'INTEGER'), ('platform_id', 'INTEGER'),
+        ('username_on_platform', 'TEXT'), ('auth_token', 'TEXT'),
+        ('refresh_token', 'TEXT'), ('token_expires_at', 'TEXT')
+    ],
+    'Playlist': [
+        ('account_id', 'INTEGER'), ('name', 'TEXT'),
+        ('description', 'TEXT'), ('last_updated', 'TEXT')
+    ],
+    'Song': [('title', 'TEXT'), ('artist', 'TEXT'), ('album', 'TEXT'), ('duration', 'INTEGER')],
+    'PlatformSong': [
+        ('song_id', 'INTEGER'), ('platform_id', 'INTEGER'), ('platform_specific_id', 'TEXT'),
+        ('matched_at', 'TEXT'), ('platform_title', 'TEXT'), ('platform_artists', 'TEXT'),
+        ('platform_album', 'TEXT'), ('platform_duration', 'INTEGER')
+    ],
+    'PlaylistSong': [('playlist_id', 'INTEGER'), ('song_id', 'INTEGER'), ('added_at', 'TEXT')],
+    'SyncLog': [
+        ('user_id', 'INTEGER'), ('source_account_id', 'INTEGER'),
+        ('destination_account_id', 'INTEGER'), ('playlist_id', 'INTEGER'),
+        ('total_songs_synced', 'INTEGER'), ('songs_added', 'INTEGER'),
+        ('songs_removed', 'INTEGER'), ('timestamp', 'TEXT')
+    ]
+}
+
+# Rows fetched per round trip by iter_select
+ITER_BATCH_SIZE = 500
+
+def _quote(name: str) -> str:
+    return f'"{name}"'
+
+class ConnectionPool:
+    """Bounded pool of DB-API connections shared by all threads"""
+
+    def __init__(self, connect, size: int = 10):
+        self._connect = connect
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def acquire(self):
+        self._slots.acquire()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            try:
+                return self._connect()
+            except Exception:
+                self._slots.release()
+                raise
+
+    def release(self, conn, broken: bool = False) -> None:
+        if broken:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        else:
+            self._idle.put(conn)
+        self._slots.release()
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+class SQLDatabase(StorageEngine):
+    """Storage engine backed by SQLite or PostgreSQL.
+
+    Connections come from a bounded pool, and the schema, indexes and
+    unique keys mirror the in-memory store. SQL text is built once per
+    statement shape and cached. SQLite also keeps the compiled statements
+    (cached_statements); psycopg2 interpolates parameters on the client,
+    so PostgreSQL parses each statement again.
+    """
+
+    def __init__(self, url: str, pool_size: int = 10):
+        if url.startswith('sqlite:///'):
+            self.dialect = 'sqlite'
+            path = url[len('sqlite:///'):]
+
+            def connect():
+                conn = sqlite3.connect(path, check_same_thread=False, timeout=30,
+                                       cached_statements=256)
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.execute('PRAGMA synchronous=NORMAL')
+                return conn
+            self.integrity_errors: Tuple[type, ...] = (sqlite3.IntegrityError,)
+        elif url.startswith(('postgresql://', 'postgres://')):
+            import psycopg2
+            self.dialect = 'postgresql'
+
+            def connect():
+                return psycopg2.connect(url)
+            self.integrity_errors = (psycopg2.IntegrityError,)
+        else:
+            raise ValueError(f"Unsupported database URL: {url}")
+
+        self.placeholder = '?' if self.dialect == 'sqlite' else '%s'
+        self.primary_keys = dict(PRIMARY_KEYS)
+        self.unique_keys = {table: list(keys) for table, keys in DEFAULT_UNIQUE_KEYS.items()}
+        self.pool = ConnectionPool(connect, pool_size)
+        self._local = threading.local()
+        self._create_schema()
+
+    @contextmanager
+    def _connection(self):
+        """Yield this thread's connection, opening a transaction if none is active"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            yield conn
+            return
+
+        conn = self.pool.acquire()
+        self._local.conn = conn
+        broken = False
+        try:
+            yield conn
+            conn.commit()
+        except self.integrity_errors as e:
+            conn.rollback()
+            raise IntegrityError(str(e)) from e
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                broken = True
+            raise
+        finally:
+            self._local.conn = None
+            self.pool.release(conn, broken)
+
+    def read_tables(self, *tables: str):
+        return self._connection()
+
+    def write_tables(self, *tables: str):
+        return self._connection()
+
+    def _create_schema(self) -> None:
+        id_type = 'INTEGER PRIMARY KEY AUTOINCREMENT' if self.dialect == 'sqlite' else 'SERIAL PRIMARY KEY'
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            for table, columns in SCHEMA.items():
+                definitions = [f'{_quote(name)} {column_type}' for name, column_type in columns]
+                if table in self.primary_keys:
+                    definitions.insert(0, f'{_quote(self.primary_keys[table])} {id_type}')
+                cursor.execute(f'CREATE TABLE IF NOT EXISTS {_quote(table)} ({", ".join(definitions)})')
+
+                # Add columns introduced after the table was first created
+                existing = self._columns(cursor, table)
+                for name, column_type in columns:
+                    if name not in existing:
+                        cursor.execute(f'ALTER TABLE {_quote(table)} ADD COLUMN {_quote(name)} {column_type}')
+
+            for table, columns in DEFAULT_INDEXES.items():
+                for column in columns:
+                    cursor.execute(f'CREATE INDEX IF NOT EXISTS {_quote(f"ix_{table}_{column}")} '
+                                   f'ON {_quote(table)} ({_quote(column)})')
+            for table, keys in self.unique_keys.items():
+                for columns in keys:
+                    name = f'ux_{table}_{"_".join(columns)}'
+                    cursor.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS {_quote(name)} '
+                                   f'ON {_quote(table)} ({", ".join(_quote(c) for c in columns)})')
+
+    def _columns(self, cursor, table: str) -> List[str]:
+        cursor.execute(f'SELECT * FROM {_quote(table)} WHERE 1 = 0')
+        return [description[0] for description in cursor.description]
+
+    @lru_cache(maxsize=512)
+    def _where_sql(self, columns: Tuple[str, ...], nulls: Tuple[bool, ...], prefix: str = '') -> str:
+        if not columns:
+            return ''
+        clauses = [f'{prefix}{_quote(column)} IS NULL' if is_null
+                   else f'{prefix}{_quote(column)} = {self.placeholder}'
+                   for column, is_null in zip(columns, nulls)]
+        return ' WHERE ' + ' AND '.join(clauses)
+
+    def _where(self, where: Optional[Dict[str, Any]], prefix: str = '') -> Tuple[str, List[Any]]:
+        where = where or {}
+        columns = tuple(where)
+        nulls = tuple(where[column] is None for column in columns)
+        params = [value for value in where.values() if value is not None]
+        return self._where_sql(columns, nulls, prefix), params
+
+    @lru_cache(maxsize=512)
+    def _insert_sql(self, table: str, columns: Tuple[str, ...], conflict: Optional[Tuple[str, ...]],
+                    update: Optional[Tuple[str, ...]]) -> str:
+        placeholders = ', '.join([self.placeholder] * len(columns))
+        sql = (f'INSERT INTO {_quote(table)} ({", ".join(_quote(c) for c in columns)}) '
+               f'VALUES ({placeholders})')
+        if conflict is not None:
+            target = ', '.join(_quote(c) for c in conflict)
+            if update:
+                assignments = ', '.join(f'{_quote(c)} = {self.placeholder}' for c in update)
+                sql += f' ON CONFLICT ({target}) DO UPDATE SET {assignments}'
+            else:
+                sql += f' ON CONFLICT ({target}) DO NOTHING'
+        if table in self.primary_keys:
+            sql += f' RETURNING {_quote(self.primary_keys[table])}'
+        return sql
+
+    def _conflict_columns(self, table: str, data: Dict[str, Any]) -> Optional[Tuple[str, ...]]:
+        for columns in self.unique_keys.get(table, []):
+            if all(column in data for column in columns):
+                return columns
+        return None
+
+    def insert(self, table: str, data: Dict[str, Any]) -> int:
+        sql = self._insert_sql(table, tuple(data), None, None)
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql, list(data.values()))
+            row = cursor.fetchone() if table in self.primary_keys else None
+            return row[0] if row else 0
+
+    def insert_many(self, table: str, rows: List[Dict[str, Any]]) -> List[int]:
+        with self._connection():
+            return [self.insert(table, row) for row in rows]
+
+    def upsert(self, table: str, data: Dict[str, Any],
+               update: Optional[Dict[str, Any]] = None) -> int:
+        conflict = self._conflict_columns(table, data)
+        if conflict is None:
+            return self.insert(table, data)
+
+        sql = self._insert_sql(table, tuple(data), conflict, tuple(update) if update else None)
+        params = list(data.values()) + (list(update.values()) if update else [])
+        id_field = self.primary_keys.get(table)
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql, params)
+            row = cursor.fetchone() if id_field else None
+            if row:
+                return row[0]
+            if not id_field:
+                return 0
+
+            # DO NOTHING returns no row when the record already exists
+            where_sql, where_params = self._where({column: data[column] for column in conflict})
+            cursor.execute(f'SELECT {_quote(id_field)} FROM {_quote(table)}{where_sql}', where_params)
+            row = cursor.fetchone()
+            return row[0] if row else 0
+
+    def upsert_many(self, table: str, rows: List[Dict[str, Any]],
+                    update: Optional[Dict[str, Any]] = None) -> List[int]:
+        with self._connection():
+            return [self.upsert(table, row, update) for row in rows]
+
+    def _order_columns(self, table: str) -> Tuple[str, ...]:
+        """Columns that identify a row, for paging in a stable order"""
+        if table in self.primary_keys:
+            return (self.primary_keys[table],)
+        keys = self.unique_keys.get(table)
+        return tuple(keys[0]) if keys else ()
+
+    def iter_select(self, table: str, where: Optional[Dict[str, Any]] = None,
+                    columns: Optional[List[str]] = None, limit: Optional[int] = None,
+                    offset: int = 0, copy: bool = False) -> Iterator[Dict[str, Any]]:
+        """Stream matching rows in pages; rows are fresh dicts owned by the caller.
+
+        Each page is fetched in its own short transaction and the connection
+        is released before any row is yielded, so a caller that stops early
+        leaves no transaction open. Pages continue after the last row's key
+        (primary key, else the first unique key), so rows come in key order.
+        """
+        where_sql, where_params = self._where(where)
+        order = self._order_columns(table)
+        selected = list(columns) + [c for c in order if c not in columns] if columns else None
+        projection = ', '.join(_quote(column) for column in selected) if selected else '*'
+        order_sql = ', '.join(_quote(column) for column in order)
+        remaining = limit
+        last: Optional[Tuple[Any, ...]] = None
+
+        while remaining is None or remaining > 0:
+            page_size = ITER_BATCH_SIZE if remaining is None else min(ITER_BATCH_SIZE, remaining)
+            sql = f'SELECT {projection} FROM {_quote(table)}{where_sql}'
+            params = list(where_params)
+            if last is not None and order:
+                placeholders = ', '.join([self.placeholder] * len(order))
+                sql += f'{" AND" if where_sql else " WHERE"} ({order_sql}) > ({placeholders})'
+                params.extend(last)
+            if order:
+                sql += f' ORDER BY {order_sql}'
+            sql += f' LIMIT {self.placeholder}'
+            params.append(page_size)
+            if offset:
+                sql += f' OFFSET {self.placeholder}'
+                params.append(offset)
+
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(sql, params)
+                names = [description[0] for description in cursor.description]
+                rows = [dict(zip(names, row)) for row in cursor.fetchall()]
+
+            if not rows:
+                return
+            if order:
+                last = tuple(rows[-1][column] for column in order)
+                offset = 0
+            else:
+                offset += len(rows)
+            if remaining is not None:
+                remaining -= len(rows)
+            for row in rows:
+                yield {column: row[column] for column in columns} if columns else row
+            if len(rows) < page_size:
+                return
+
+    def join(self, left: str, right: str, on: str, where: Optional[Dict[str, Any]] = None,
+             columns: Optional[List[str]] = None, order_by: Optional[str] = None,
+             descending: bool = False) -> List[Dict[str, Any]]:
+        where_sql, params = self._where(where, prefix='l.')
+        sql = (f'SELECT l.*, r.* FROM {_quote(left)} l '
+               f'JOIN {_quote(right)} r ON l.{_quote(on)} = r.{_quote(on)}{where_sql}')
+        if order_by is not None:
+            alias = 'r' if order_by in self._schema_columns(right) else 'l'
+            sql += f' ORDER BY {alias}.{_quote(order_by)}{" DESC" if descending else ""}'
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql, params)
+            names = [description[0] for description in cursor.description]
+            # Right-hand columns come last, so they win on name clashes
+            rows = [dict(zip(names, row)) for row in cursor.fetchall()]
+        if columns is not None:
+            rows = [{column: row.get(column) for column in columns} for row in rows]
+        return rows
+
+    def _schema_columns(self, table: str) -> List[str]:
+        columns = [name for name, _ in SCHEMA.get(table, [])]
+        if table in self.primary_keys:
+            columns.append(self.primary_keys[table])
+        return columns
+
+    def update(self, table: str, data: Dict[str, Any], where: Dict[str, Any]) -> int:
+        assignments = ', '.join(f'{_quote(c)} = {self.placeholder}' for c in data)
+        where_sql, params = self._where(where)
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'UPDATE {_quote(table)} SET {assignments}{where_sql}',
+                           list(data.values()) + params)
+            return cursor.rowcount
+
+    def delete(self, table: str, where: Dict[str, Any]) -> int:
+        where_sql, params = self._where(where)
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'DELETE FROM {_quote(table)}{where_sql}', params)
+            return cursor.rowcount
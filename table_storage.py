@@ -0,0 +1,539 @@
+"""
+Row storage behind InMemoryDatabase: plain dict rows for small tables and
+array-backed columns for the high-cardinality catalog tables.
+
+Rows are addressed by position. Positions stay valid until a table is
+compacted with take(), which returns a new table; the database then
+rebuilds that table's indexes and keys.
+"""
+from array import array
+from itertools import accumulate, islice
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+
+# Marks an undeclared column that a row does not have
+MISSING = object()
+
+NULL_INT = -2 ** 63
+
+# Errors a typed column raises for a value it cannot hold
+_MISFIT = (TypeError, OverflowError)
+
+class IntColumn:
+    """Integers (or None) packed 8 bytes each"""
+
+    def __init__(self, values: Sequence[Any] = ()):
+        types = set(map(type, values))
+        if types <= {int}:
+            self.data = array('q', values)
+            if NULL_INT in self.data:
+                raise TypeError("IntColumn cannot hold its null marker")
+        elif types <= {int, type(None)}:
+            self.data = array('q', map(self._pack, values))
+        else:
+            raise TypeError(f"IntColumn cannot hold {types - {int, type(None)}}")
+
+    @staticmethod
+    def _pack(value: Any) -> int:
+        if value is None:
+            return NULL_INT
+        if type(value) is not int or value == NULL_INT:
+            raise TypeError(f"IntColumn cannot hold {value!r}")
+        return value
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def append(self, value: Any) -> None:
+        self.data.append(self._pack(value))
+
+    def get(self, pos: int) -> Any:
+        value = self.data[pos]
+        return None if value == NULL_INT else value
+
+    def set(self, pos: int, value: Any) -> None:
+        self.data[pos] = self._pack(value)
+
+    def values(self) -> List[Any]:
+        values = self.data.tolist()
+        if NULL_INT in self.data:
+            return [None if value == NULL_INT else value for value in values]
+        return values
+
+class TextColumn:
+    """Strings (or None) stored as UTF-8 in one shared buffer.
+
+    A row costs 12 bytes of offsets plus its encoded text, against about
+    50 bytes of object header for a str. Overwritten text stays in the
+    buffer until the table is compacted.
+    """
+
+    def __init__(self, values: Sequence[Any] = ()):
+        if set(map(type, values)) <= {str}:
+            text = ''.join(values)
+            if text.isascii():
+                # One byte per character, so lengths and offsets come from len()
+                self.data = bytearray(text.encode('ascii'))
+                self.lengths = array('i', map(len, values))
+                self.starts = array('q', islice(accumulate(self.lengths, initial=0), len(values)))
+                return
+        encoded = [self._encode(value) for value in values]
+        sizes = [len(text) if text is not None else 0 for text in encoded]
+        self.data = bytearray().join(text for text in encoded if text)
+        self.starts = array('q', islice(accumulate(sizes, initial=0), len(sizes)))
+        self.lengths = array('i', [len(text) if text is not None else -1 for text in encoded])
+
+    @staticmethod
+    def _encode(value: Any) -> Optional[bytes]:
+        if value is None:
+            return None
+        if type(value) is not str:
+            raise TypeError(f"TextColumn cannot hold {value!r}")
+        return value.encode('utf-8', 'surrogatepass')
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    def append(self, value: Any) -> None:
+        text = self._encode(value)
+        self.starts.append(len(self.data))
+        self.lengths.append(len(text) if text is not None else -1)
+        if text:
+            self.data += text
+
+    def get(self, pos: int) -> Optional[str]:
+        length = self.lengths[pos]
+        if length < 0:
+            return None
+        start = self.starts[pos]
+        return self.data[start:start + length].decode('utf-8', 'surrogatepass')
+
+    def set(self, pos: int, value: Any) -> None:
+        text = self._encode(value)
+        self.starts[pos] = len(self.data)
+        self.lengths[pos] = len(text) if text is not None else -1
+        if text:
+            self.data += text
+
+    def values(self) -> List[Optional[str]]:
+        data = self.data
+        return [data[start:start + length].decode('utf-8', 'surrogatepass') if length >= 0 else None
+                for start, length in zip(self.starts, self.lengths)]
+
+class EnumColumn:
+    """Repeating values (artists, albums, timestamps) stored once each,
+    with a 4-byte code per row.
+
+    The distinct values are kept in a column of their own (UTF-8 text when
+    they are all strings) and found through a KeyIndex, so a new value
+    costs a few dozen bytes instead of a str object and a dict entry.
+    """
+
+    def __init__(self, values: Sequence[Any] = ()):
+        if len(set(map(type, values)) - {type(None)}) <= 1:
+            # One value type, so equal values are interchangeable
+            code_of = {value: code for code, value in enumerate(dict.fromkeys(values))}
+            self.codes = array('i', map(code_of.__getitem__, values))
+            self._store_distinct(list(code_of))
+        else:
+            self._store_distinct([])
+            self.codes = array('i', map(self._code, values))
+
+    def _store_distinct(self, distinct: List[Any]) -> None:
+        try:
+            self.distinct = TextColumn(distinct)
+        except _MISFIT:
+            self.distinct = ObjectColumn(distinct)
+        self.code_of = KeyIndex(self.distinct.get, distinct)
+
+    def _code(self, value: Any) -> int:
+        code = self.code_of.get(value)
+        if code is None:
+            code = len(self.distinct)
+            try:
+                self.distinct.append(value)
+            except _MISFIT:
+                self.distinct = ObjectColumn(self.distinct.values() + [value])
+                self.code_of.key_of = self.distinct.get
+            self.code_of.add(value, code)
+        elif type(self.distinct.get(code)) is not type(value):
+            # 1, 1.0 and True are equal keys but different values
+            raise TypeError(f"EnumColumn cannot hold both {self.distinct.get(code)!r} and {value!r}")
+        return code
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def append(self, value: Any) -> None:
+        self.codes.append(self._code(value))
+
+    def get(self, pos: int) -> Any:
+        return self.distinct.get(self.codes[pos])
+
+    def set(self, pos: int, value: Any) -> None:
+        self.codes[pos] = self._code(value)
+
+    def values(self) -> List[Any]:
+        return list(map(self.distinct.values().__getitem__, self.codes))
+
+class ObjectColumn:
+    """Arbitrary Python values in a plain list"""
+
+    def __init__(self, values: Sequence[Any] = ()):
+        self.data = list(values)
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def append(self, value: Any) -> None:
+        self.data.append(value)
+
+    def get(self, pos: int) -> Any:
+        return self.data[pos]
+
+    def set(self, pos: int, value: Any) -> None:
+        self.data[pos] = value
+
+    def values(self) -> List[Any]:
+        return list(self.data)
+
+COLUMN_KINDS = {'int': IntColumn, 'text': TextColumn, 'enum': EnumColumn, 'object': ObjectColumn}
+
+
+class RowTable:
+    """Rows kept as plain dicts; row() returns the stored dict itself"""
+
+    def __init__(self, rows: Optional[List[Dict[str, Any]]] = None):
+        self.rows = rows if rows is not None else []
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def append(self, row: Dict[str, Any]) -> int:
+        """Store a row (not copied) and return its position"""
+        self.rows.append(row)
+        return len(self.rows) - 1
+
+    def get(self, pos: int, column: str, default: Any = None) -> Any:
+        return self.rows[pos].get(column, default)
+
+    def row(self, pos: int) -> Dict[str, Any]:
+        return self.rows[pos]
+
+    def rows_at(self, positions: Iterable[int]) -> List[Dict[str, Any]]:
+        rows = self.rows
+        return [rows[pos] for pos in positions]
+
+    def key(self, pos: int, columns: Tuple[str, ...]) -> Any:
+        row = self.rows[pos]
+        if len(columns) == 1:
+            return row.get(columns[0])
+        return tuple(row.get(column) for column in columns)
+
+    def update(self, pos: int, data: Dict[str, Any]) -> None:
+        self.rows[pos].update(data)
+
+    def column(self, name: str) -> List[Any]:
+        return [row.get(name) for row in self.rows]
+
+    def take(self, positions: Iterable[int]) -> 'RowTable':
+        """A new table holding only the rows at `positions`, in order"""
+        return RowTable(self.rows_at(positions))
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        return [row.copy() for row in self.rows]
+
+    def load(self, stored: Any) -> None:
+        """Fill an empty table from snapshot() output (or the column-wise form)"""
+        if isinstance(stored, list):
+            self.rows = stored
+            return
+        self.rows = [dict(zip(stored['fields'], values)) for values in zip(*stored['columns'])]
+        for pos, extra in stored['extras'].items():
+            self.rows[pos].update(extra)
+
+class ColumnTable:
+    """Rows stored column by column in typed arrays.
+
+    Declared columns exist in every row (None when unset). A value that
+    does not fit its column's kind turns that column into a plain list.
+    Undeclared columns are plain lists holding MISSING where a row lacks
+    them. row() builds a new dict, so rows read here are copies.
+    """
+
+    def __init__(self, kinds: Dict[str, str]):
+        self.fields = tuple(kinds)
+        self.field_set = frozenset(kinds)
+        self.columns: Dict[str, Any] = {name: COLUMN_KINDS[kind]() for name, kind in kinds.items()}
+        self.extras: Dict[str, ObjectColumn] = {}
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def _write(self, name: str, pos: int, value: Any) -> None:
+        column = self.columns[name]
+        try:
+            if pos == self.size:
+                column.append(value)
+            else:
+                column.set(pos, value)
+        except _MISFIT:
+            column = self.columns[name] = ObjectColumn(column.values())
+            if pos == self.size:
+                column.append(value)
+            else:
+                column.set(pos, value)
+
+    def _write_extra(self, name: str, pos: int, value: Any) -> None:
+        column = self.extras.get(name)
+        if column is None:
+            column = self.extras[name] = ObjectColumn([MISSING] * self.size)
+        if pos == self.size:
+            column.append(value)
+        else:
+            column.set(pos, value)
+
+    def append(self, row: Dict[str, Any]) -> int:
+        """Store a row's values and return its position"""
+        pos = self.size
+        for name in self.fields:
+            self._write(name, pos, row.get(name))
+        for name, column in self.extras.items():
+            column.append(row.get(name, MISSING))
+        for name, value in row.items():
+            if name not in self.field_set and name not in self.extras:
+                self._write_extra(name, pos, value)
+        self.size += 1
+        return pos
+
+    def get(self, pos: int, column: str, default: Any = None) -> Any:
+        values = self.columns.get(column)
+        if values is not None:
+            return values.get(pos)
+        values = self.extras.get(column)
+        if values is None:
+            return default
+        value = values.get(pos)
+        return default if value is MISSING else value
+
+    def row(self, pos: int) -> Dict[str, Any]:
+        row = {name: column.get(pos) for name, column in self.columns.items()}
+        for name, column in self.extras.items():
+            value = column.get(pos)
+            if value is not MISSING:
+                row[name] = value
+        return row
+
+    def rows_at(self, positions: Iterable[int]) -> List[Dict[str, Any]]:
+        positions = list(positions)
+        if len(positions) < self.size // 8:
+            return [self.row(pos) for pos in positions]
+        # Reading whole columns is cheaper than many single-row reads
+        names = list(self.columns)
+        picked = [self._pick(column, positions) for column in self.columns.values()]
+        rows = [dict(zip(names, values)) for values in zip(*picked)]
+        for name, column in self.extras.items():
+            for row, value in zip(rows, self._pick(column, positions)):
+                if value is not MISSING:
+                    row[name] = value
+        return rows
+
+    def _pick(self, column: Any, positions: List[int]) -> List[Any]:
+        values = column.values()
+        if len(positions) == self.size:
+            return values
+        return [values[pos] for pos in positions]
+
+    def key(self, pos: int, columns: Tuple[str, ...]) -> Any:
+        if len(columns) == 1:
+            return self.get(pos, columns[0])
+        return tuple(self.get(pos, column) for column in columns)
+
+    def update(self, pos: int, data: Dict[str, Any]) -> None:
+        for name, value in data.items():
+            if name in self.field_set:
+                self._write(name, pos, value)
+            else:
+                self._write_extra(name, pos, value)
+
+    def column(self, name: str) -> List[Any]:
+        values = self.columns.get(name)
+        if values is not None:
+            return values.values()
+        values = self.extras.get(name)
+        if values is None:
+            return [None] * self.size
+        return [None if value is MISSING else value for value in values.data]
+
+    def take(self, positions: Iterable[int]) -> 'ColumnTable':
+        """A new table holding only the rows at `positions`, in order.
+
+        Columns are rebuilt, which also drops text overwritten by updates.
+        """
+        positions = list(positions)
+        table = ColumnTable.__new__(ColumnTable)
+        table.fields, table.field_set = self.fields, self.field_set
+        table.columns = {name: type(column)(self._pick(column, positions))
+                         for name, column in self.columns.items()}
+        table.extras = {name: ObjectColumn(self._pick(column, positions))
+                        for name, column in self.extras.items()}
+        table.size = len(positions)
+        return table
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Column-wise copy: declared columns as lists, other columns per row"""
+        extras: Dict[int, Dict[str, Any]] = {}
+        for name, column in self.extras.items():
+            for pos, value in enumerate(column.data):
+                if value is not MISSING:
+                    extras.setdefault(pos, {})[name] = value
+        return {
+            'fields': self.fields,
+            'columns': [column.values() for column in self.columns.values()],
+            'extras': extras
+        }
+
+    def load(self, stored: Any) -> None:
+        """Fill an empty table from snapshot() output (or a list of row dicts)"""
+        if isinstance(stored, list):
+            for row in stored:
+                self.append(row)
+            return
+        columns = stored['columns']
+        size = len(columns[0]) if columns else 0
+        given = dict(zip(stored['fields'], columns))
+        for name in self.fields:
+            values = given.pop(name, None)
+            if values is None:
+                values = [None] * size
+            try:
+                self.columns[name] = type(self.columns[name])(values)
+            except _MISFIT:
+                self.columns[name] = ObjectColumn(values)
+        # Columns the snapshot declared but this table does not
+        for name, values in given.items():
+            self.extras[name] = ObjectColumn(values)
+        self.size = size
+        for pos, extra in stored['extras'].items():
+            self.update(pos, extra)
+
+_EMPTY = -1
+_DELETED = -2
+# 2**32 divided by the golden ratio, spreads 32-bit hash tags over the slots
+_FIBONACCI = 2654435769
+
+class KeyIndex:
+    """Unique key -> row position map that keeps no key objects.
+
+    Open addressing with linear probing over two flat arrays: the row
+    position in each slot and a 32-bit tag of its key's hash. A key is
+    read back from the table through `key_of` only to confirm a tag
+    match, so an entry costs 8 bytes per slot rather than a key tuple,
+    a position int and a dict entry. Bulk builds place every row with
+    numpy in a few vectorized passes.
+    """
+
+    def __init__(self, key_of: Callable[[int], Any], keys: Iterable[Any] = (),
+                 positions: Optional[Sequence[int]] = None):
+        self.key_of = key_of
+        tags = np.array(list(map(hash, keys)), dtype=np.int64).astype(np.uint32)
+        if positions is None:
+            positions = np.arange(len(tags), dtype=np.int32)
+        self._place(np.asarray(positions, dtype=np.int32), tags)
+
+    def _place(self, positions: np.ndarray, tags: np.ndarray) -> None:
+        """Lay out the table for these entries, at most half full"""
+        bits = max(3, (2 * len(positions)).bit_length())
+        self.shift = 32 - bits
+        self.mask = (1 << bits) - 1
+        slots = np.full(1 << bits, _EMPTY, dtype=np.int32)
+        slot_tags = np.zeros(1 << bits, dtype=np.uint32)
+
+        home = (tags.astype(np.uint64) * np.uint64(_FIBONACCI)) & np.uint64(0xFFFFFFFF)
+        probe = (home >> np.uint64(self.shift)).astype(np.intp)
+        pending = np.arange(len(positions))
+        while pending.size:
+            # Every pending entry whose probe slot is free claims it, one per slot
+            free = np.flatnonzero(slots[probe] == _EMPTY)
+            claimed, first = np.unique(probe[free], return_index=True)
+            winners = pending[free[first]]
+            slots[claimed] = positions[winners]
+            slot_tags[claimed] = tags[winners]
+            waiting = np.ones(len(pending), dtype=bool)
+            waiting[free[first]] = False
+            pending = pending[waiting]
+            probe = (probe[waiting] + 1) & self.mask
+
+        self.slots = array('i', slots.tobytes())
+        self.tags = array('I', slot_tags.tobytes())
+        self.count = self.used = len(positions)
+
+    def _home(self, tag: int) -> int:
+        return ((tag * _FIBONACCI) & 0xFFFFFFFF) >> self.shift
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __contains__(self, key: Any) -> bool:
+        return self.get(key) is not None
+
+    def get(self, key: Any, default: Optional[int] = None) -> Optional[int]:
+        """Position of the row holding `key`, or `default`"""
+        tag = hash(key) & 0xFFFFFFFF
+        slots, tags, mask = self.slots, self.tags, self.mask
+        i = self._home(tag)
+        while True:
+            pos = slots[i]
+            if pos == _EMPTY:
+                return default
+            if pos >= 0 and tags[i] == tag and self.key_of(pos) == key:
+                return pos
+            i = (i + 1) & mask
+
+    def add(self, key: Any, pos: int) -> None:
+        """Map `key` to `pos`, replacing any position it had"""
+        tag = hash(key) & 0xFFFFFFFF
+        slots, tags, mask = self.slots, self.tags, self.mask
+        i = self._home(tag)
+        free = None
+        while True:
+            current = slots[i]
+            if current == _EMPTY:
+                break
+            if current == _DELETED:
+                if free is None:
+                    free = i
+            elif tags[i] == tag and self.key_of(current) == key:
+                slots[i] = pos
+                return
+            i = (i + 1) & mask
+        if free is None:
+            free = i
+            self.used += 1
+        slots[free] = pos
+        tags[free] = tag
+        self.count += 1
+        if self.used * 3 > len(slots) * 2:
+            self._grow()
+
+    def remove(self, key: Any, pos: int) -> None:
+        """Unmap `key` if it maps to `pos`"""
+        tag = hash(key) & 0xFFFFFFFF
+        slots, tags, mask = self.slots, self.tags, self.mask
+        i = self._home(tag)
+        while True:
+            current = slots[i]
+            if current == _EMPTY:
+                return
+            if current == pos and tags[i] == tag:
+                slots[i] = _DELETED
+                self.count -= 1
+                return
+            i = (i + 1) & mask
+
+    def _grow(self) -> None:
+        """Re-place the live entries, dropping deleted slots"""
+        slots = np.frombuffer(self.slots, dtype=np.int32)
+        live = slots >= 0
+        self._place(slots[live].copy(), np.frombuffer(self.tags, dtype=np.uint32)[live].copy())
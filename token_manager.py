@@ -0,0 +1,102 @@
+import os
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional
+from cache import LRUCache
+from database import get_account_by_id, get_account_by_token, update_account_tokens
+from singleflight import SingleFlight
+
+# Refresh access tokens this many seconds before they expire
+REFRESH_MARGIN = int(os.getenv('SPOTIFY_TOKEN_REFRESH_MARGIN', '300'))
+
+def token_expiry(expires_in: Optional[int]) -> Optional[str]:
+    """Expiry timestamp for a token response's expires_in, in the database's ISO format"""
+    if not expires_in:
+        return None
+    return (datetime.now() + timedelta(seconds=int(expires_in))).isoformat()
+
+class TokenManager:
+    """Keeps OAuth access tokens for linked accounts usable.
+
+    Tokens are refreshed shortly before their stored expiry and again when
+    a request comes back 401. Concurrent refreshes of the same account share
+    one call to the token endpoint, and a caller still holding a token that
+    was just replaced is handed the replacement instead of refreshing again.
+    """
+
+    def __init__(self, refresh: Callable[[str], Optional[Dict[str, Any]]], margin: int = REFRESH_MARGIN):
+        self._refresh = refresh
+        self.margin = timedelta(seconds=margin)
+        self._flights = SingleFlight()
+        # Recently replaced access tokens, so late 401s can still find their account
+        self._replaced = LRUCache(1024)
+        self._lock = threading.Lock()
+        self._stats = {'proactive': 0, 'unauthorized': 0, 'refreshed': 0, 'failed': 0}
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._stats[name] += 1
+
+    def _expiring(self, account: Dict[str, Any]) -> bool:
+        expires_at = account.get('token_expires_at')
+        if not expires_at:
+            return False
+        return datetime.fromisoformat(expires_at) - self.margin <= datetime.now()
+
+    def get_access_token(self, account: Dict[str, Any]) -> str:
+        """Return the account's access token, refreshing it first if it is about to expire"""
+        if account.get('refresh_token') and self._expiring(account):
+            self._count('proactive')
+            token = self.refresh(account['account_id'], account['auth_token'])
+            if token:
+                return token
+        return account['auth_token']
+
+    def handle_unauthorized(self, access_token: str) -> Optional[str]:
+        """Return a fresh token to retry a request that was answered 401, or None"""
+        self._count('unauthorized')
+        account = get_account_by_token(access_token)
+        account_id = account['account_id'] if account else self._replaced.get(access_token)
+        if account_id is None:
+            return None
+        return self.refresh(account_id, access_token)
+
+    def current_token(self, access_token: str) -> str:
+        """Return the token that replaced `access_token`, or the token itself if it is still current"""
+        account_id = self._replaced.get(access_token)
+        if account_id is None:
+            return access_token
+        account = get_account_by_id(account_id)
+        return account['auth_token'] if account and account.get('auth_token') else access_token
+
+    def refresh(self, account_id: int, stale_token: str) -> Optional[str]:
+        """Replace `stale_token` for an account; concurrent callers share one refresh"""
+        return self._flights.do(account_id, lambda: self._refresh_account(account_id, stale_token))
+
+    def _refresh_account(self, account_id: int, stale_token: str) -> Optional[str]:
+        account = get_account_by_id(account_id)
+        if not account or not account.get('refresh_token'):
+            return None
+        if account['auth_token'] != stale_token:
+            # Someone refreshed it between our read and this call
+            return account['auth_token']
+
+        token_data = self._refresh(account['refresh_token'])
+        if not token_data or not token_data.get('access_token'):
+            self._count('failed')
+            logging.warning(f"Could not refresh access token for account {account_id}")
+            return None
+
+        update_account_tokens(account_id, token_data['access_token'], token_data.get('refresh_token'),
+                              token_expiry(token_data.get('expires_in')))
+        self._replaced.put(stale_token, account_id)
+        self._count('refreshed')
+        return token_data['access_token']
+
+    def metrics(self) -> Dict[str, Any]:
+        """Refresh counters plus how many refreshes were shared between callers"""
+        with self._lock:
+            metrics: Dict[str, Any] = dict(self._stats)
+        metrics['shared'] = self._flights.metrics()['shared']
+        return metrics
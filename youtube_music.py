@@ -1,54 +1,126 @@
 import os
-from typing import Optional, Dict, Any, List
+import asyncio
+import threading
+from typing import Optional, Dict, Any, List, Iterator
 from ytmusicapi import YTMusic
 from database import db, get_platform_by_name, create_user_platform_account, get_user_accounts
+from async_bridge import run_sync, to_thread, run_in_background
+from ytmusic_pool import get_ytmusic_pool, build_client
+from match_cache import match_cache
+from match_scoring import MATCH_CANDIDATES, pick_best
+from singleflight import SingleFlight
+from cache import RefreshingCache
 import logging
 
+try:
+    # Not public API: laid out as in the ytmusicapi release pinned in pyproject.toml.
+    # Without them iter_playlist_tracks warns and loads playlists whole.
+    from ytmusicapi.continuations import CONTINUATION_ITEMS, get_continuation_token
+    from ytmusicapi.navigation import nav, TWO_COLUMN_RENDERER, SECTION, CONTENT
+    from ytmusicapi.parsers.playlists import parse_playlist_items
+    _paging_error: Optional[str] = None
+except ImportError as e:
+    _paging_error = f"ytmusicapi internals changed ({e})"
+
+# Searches a single sync keeps in flight at once, and how long one may take
+SEARCH_CONCURRENCY = int(os.getenv('YTMUSIC_SEARCH_CONCURRENCY', '8'))
+SEARCH_TIMEOUT = float(os.getenv('YTMUSIC_SEARCH_TIMEOUT', '15'))
+
+# Identical searches in flight at the same time, from any sync, share one request
+search_flights = SingleFlight()
+_dedup_lock = threading.Lock()
+_deduplicated = 0
+
+# Public playlist search results are served from cache and refreshed in the
+# background once older than PLAYLISTS_TTL, dropped after PLAYLISTS_MAX_STALE
+PLAYLISTS_TTL = float(os.getenv('YTMUSIC_PLAYLISTS_TTL', '600'))
+PLAYLISTS_MAX_STALE = float(os.getenv('YTMUSIC_PLAYLISTS_MAX_STALE', '86400'))
+
+# Page size when a playlist has to be loaded whole and sliced up
+PLAYLIST_PAGE_SIZE = 100
+
 def setup_ytmusic() -> Optional[YTMusic]:
     """Setup YTMusic client"""
     try:
         # For public access, we don't need authentication headers
         # This allows us to search and access public playlists
-        ytmusic = YTMusic()
+        ytmusic = build_client()
         return ytmusic
     except Exception as e:
         logging.error(f"Error setting up YTMusic: {e}")
         return None
 
+def _song_result(song: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        'videoId': song.get('videoId'),
+        'title': song.get('title'),
+        'artists': [artist.get('name') for artist in song.get('artists', [])],
+        'album': song.get('album', {}).get('name', '') if song.get('album') else '',
+        'duration': song.get('duration_seconds', 0)
+    }
+
 def search_song(ytmusic: YTMusic, query: str) -> Optional[Dict[str, Any]]:
     """Search for a song on YouTube Music"""
     try:
         results = ytmusic.search(query, filter="songs", limit=1)
         if results:
-            song = results[0]
-            return {
-                'videoId': song.get('videoId'),
-                'title': song.get('title'),
-                'artists': [artist.get('name') for artist in song.get('artists', [])],
-                'album': song.get('album', {}).get('name', '') if song.get('album') else '',
-                'duration': song.get('duration_seconds', 0)
-            }
+            return _song_result(results[0])
     except Exception as e:
         logging.error(f"Error searching song on YouTube Music: {e}")
+        get_ytmusic_pool().report_error(ytmusic)
     
     return None
 
+def search_candidates(ytmusic: YTMusic, query: str, limit: int = MATCH_CANDIDATES) -> List[Dict[str, Any]]:
+    """Top `limit` song results for a query, from the same single search request"""
+    try:
+        results = ytmusic.search(query, filter="songs", limit=limit)
+        return [_song_result(song) for song in results[:limit] if song.get('videoId')]
+    except Exception as e:
+        logging.error(f"Error searching song on YouTube Music: {e}")
+        get_ytmusic_pool().report_error(ytmusic)
+        return []
+
+def _search_public_playlists(ytmusic: YTMusic, query: str) -> List[Dict[str, Any]]:
+    results = ytmusic.search(query, filter="playlists", limit=10)
+    playlists = []
+    
+    for playlist in results:
+        playlists.append({
+            'playlistId': playlist.get('browseId'),
+            'title': playlist.get('title'),
+            'description': playlist.get('description', ''),
+            'trackCount': playlist.get('videoCount', 0),
+            'thumbnails': playlist.get('thumbnails', [])
+        })
+    
+    return playlists
+
 def get_public_playlists(ytmusic: YTMusic, query: str = "Top Songs") -> List[Dict[str, Any]]:
     """Get public playlists from YouTube Music"""
     try:
-        results = ytmusic.search(query, filter="playlists", limit=10)
-        playlists = []
-        
-        for playlist in results:
-            playlists.append({
-                'playlistId': playlist.get('browseId'),
-                'title': playlist.get('title'),
-                'description': playlist.get('description', ''),
-                'trackCount': playlist.get('videoCount', 0),
-                'thumbnails': playlist.get('thumbnails', [])
-            })
-        
-        return playlists
+        return _search_public_playlists(ytmusic, query)
+    except Exception as e:
+        logging.error(f"Error getting public playlists: {e}")
+        get_ytmusic_pool().report_error(ytmusic)
+        return []
+
+def _load_public_playlists(query: str) -> List[Dict[str, Any]]:
+    # Raises on failure so the cache keeps serving the previous result
+    with get_ytmusic_pool().client() as ytmusic:
+        return _search_public_playlists(ytmusic, query)
+
+public_playlists = RefreshingCache(_load_public_playlists, ttl=PLAYLISTS_TTL, max_stale=PLAYLISTS_MAX_STALE,
+                                   submit=run_in_background)
+
+def get_public_playlists_cached(query: str = "Top Songs") -> List[Dict[str, Any]]:
+    """Public playlists for a query from a cache shared by all users.
+
+    Only the first request for a query, or one after the result went
+    unused for PLAYLISTS_MAX_STALE, waits on YouTube Music.
+    """
+    try:
+        return public_playlists.get(query)
     except Exception as e:
         logging.error(f"Error getting public playlists: {e}")
         return []
@@ -56,24 +128,68 @@ def get_public_playlists(ytmusic: YTMusic, query: str = "Top Songs") -> List[Dic
 def get_playlist_tracks(ytmusic: YTMusic, playlist_id: str) -> List[Dict[str, Any]]:
     """Get tracks from a YouTube Music playlist"""
     try:
-        playlist = ytmusic.get_playlist(playlist_id, limit=None)
         tracks = []
-        
-        for track in playlist.get('tracks', []):
-            if track.get('videoId'):
-                tracks.append({
-                    'videoId': track['videoId'],
-                    'title': track.get('title'),
-                    'artists': [artist.get('name') for artist in track.get('artists', [])],
-                    'album': track.get('album', {}).get('name', '') if track.get('album') else '',
-                    'duration': track.get('duration_seconds', 0)
-                })
-        
+        for page in iter_playlist_tracks(ytmusic, playlist_id):
+            tracks.extend(page)
         return tracks
     except Exception as e:
         logging.error(f"Error getting playlist tracks: {e}")
+        get_ytmusic_pool().report_error(ytmusic)
         return []
 
+def _playlist_page(tracks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # Unavailable tracks have no videoId
+    return [_song_result(track) for track in tracks if track.get('videoId')]
+
+def _playlist_shelf(ytmusic: YTMusic, playlist_id: str) -> Optional[Dict[str, Any]]:
+    """First page of a playlist's track shelf, or None if it has to be loaded whole"""
+    if playlist_id.startswith(('OLA', 'VLOLA')):
+        # Album playlists use a different layout, which get_playlist handles
+        return None
+    if _paging_error is not None:
+        logging.warning(f"Loading playlist {playlist_id} whole: {_paging_error}")
+        return None
+    browse_id = playlist_id if playlist_id.startswith('VL') else 'VL' + playlist_id
+    response = ytmusic._send_request('browse', {'browseId': browse_id})
+    shelf = nav(response, [*TWO_COLUMN_RENDERER, 'secondaryContents', *SECTION, *CONTENT,
+                           'musicPlaylistShelfRenderer'], True)
+    if shelf is None:
+        logging.warning(f"Loading playlist {playlist_id} whole: unrecognized browse response")
+    return shelf
+
+def iter_playlist_tracks(ytmusic: YTMusic, playlist_id: str,
+                         cancel: Optional[threading.Event] = None) -> Iterator[List[Dict[str, Any]]]:
+    """Yield a playlist's normalized tracks one page at a time.
+    
+    Pages (about 100 tracks) follow YouTube Music's continuation tokens and
+    are requested only as the consumer asks for them, so memory stays at
+    one page however long the playlist is. Setting `cancel` stops before
+    the next request. Album playlists, or a response this can't walk, are
+    loaded whole with get_playlist and sliced instead. Unlike
+    get_playlist_tracks, errors are raised to the consumer.
+    """
+    if cancel is not None and cancel.is_set():
+        return
+    shelf = _playlist_shelf(ytmusic, playlist_id)
+    if shelf is None:
+        tracks = _playlist_page(ytmusic.get_playlist(playlist_id, limit=None).get('tracks', []))
+        for start in range(0, len(tracks), PLAYLIST_PAGE_SIZE):
+            if cancel is not None and cancel.is_set():
+                return
+            yield tracks[start:start + PLAYLIST_PAGE_SIZE]
+        return
+    
+    contents = shelf.get('contents', [])
+    while contents:
+        page = _playlist_page(parse_playlist_items(contents))
+        if page:
+            yield page
+        token = get_continuation_token(contents)
+        if not token or (cancel is not None and cancel.is_set()):
+            return
+        response = ytmusic._send_request('browse', {'continuation': token})
+        contents = nav(response, CONTINUATION_ITEMS, True) or []
+
 def create_search_query(title: str, artists: List[str], album: str = "") -> str:
     """Create a search query for YouTube Music"""
     artist_str = " ".join(artists) if artists else ""
@@ -104,29 +220,138 @@ def link_youtube_music_account(user_id: int, username: str = "public_access") ->
     
     return True
 
-def sync_to_youtube_music(songs: List[Dict[str, Any]]) -> Dict[str, Any]:
-    """Sync songs to YouTube Music (search and match)"""
-    ytmusic = setup_ytmusic()
-    if not ytmusic:
+def normalize_query(query: str) -> str:
+    """Search query with case and spacing differences removed, for coalescing"""
+    return ' '.join(query.casefold().split())
+
+def search_song_pooled(query: str) -> Optional[Dict[str, Any]]:
+    """Search for a song using a client checked out from the shared pool.
+
+    Concurrent calls for the same normalized query share one search.
+    """
+    def search() -> Optional[Dict[str, Any]]:
+        with get_ytmusic_pool().client() as ytmusic:
+            return search_song(ytmusic, query)
+    
+    return search_flights.do(('song', normalize_query(query)), search)
+
+def search_candidates_pooled(query: str, limit: int = MATCH_CANDIDATES) -> List[Dict[str, Any]]:
+    """search_candidates using a client checked out from the shared pool.
+
+    Concurrent calls for the same normalized query share one search.
+    """
+    def search() -> List[Dict[str, Any]]:
+        with get_ytmusic_pool().client() as ytmusic:
+            return search_candidates(ytmusic, query, limit)
+    
+    return search_flights.do(('candidates', normalize_query(query), limit), search)
+
+def _count_deduplicated(count: int) -> None:
+    global _deduplicated
+    with _dedup_lock:
+        _deduplicated += count
+
+def search_metrics() -> Dict[str, int]:
+    """Search coalescing counters and the outbound searches they saved.
+
+    `shared` counts calls that joined another caller's in-flight search,
+    `deduplicated` songs that repeated a query earlier in the same sync.
+    """
+    metrics = search_flights.metrics()
+    with _dedup_lock:
+        metrics['deduplicated'] = _deduplicated
+    metrics['saved'] = metrics['shared'] + metrics['deduplicated']
+    return metrics
+
+def _song_query(song: Dict[str, Any]) -> str:
+    """Search query for a song from any platform's track dict"""
+    artists = song.get('artists', [])
+    if isinstance(artists, str):
+        artists = [artists]
+    
+    return create_search_query(
+        title=song.get('name', song.get('title', '')),
+        artists=artists,
+        album=song.get('album', '')
+    )
+
+async def match_songs_async(songs: List[Dict[str, Any]], parallelism: Optional[int] = None,
+                            timeout: Optional[float] = None) -> List[Optional[Dict[str, Any]]]:
+    """Find a YouTube Music match for each song, returned in input order.
+
+    Songs with a match in the shared match cache are not searched. For the
+    rest, at most `parallelism` searches are in flight at once, so
+    wall-clock time grows with misses / parallelism. A search that takes
+    longer than `timeout` seconds, including waiting for a pooled client,
+    counts as not found. Songs sharing a normalized query are searched
+    once, and a query already being searched by another sync joins that
+    search instead of issuing its own. Each search returns the top
+    MATCH_CANDIDATES results, which are scored together once all searches
+    finish (see match_scoring); a song whose best candidate scores below
+    the threshold is not found. New matches are written back to the cache.
+
+    A timed-out search is abandoned, not interrupted: its executor thread
+    and pooled client stay busy until the HTTP request returns or hits
+    YTMUSIC_REQUEST_TIMEOUT, and only then is the client checked back in.
+    While that happens the search no longer counts against `parallelism`,
+    so a slow service can briefly hold more clients than that.
+    """
+    semaphore = asyncio.Semaphore(parallelism or SEARCH_CONCURRENCY)
+    timeout = SEARCH_TIMEOUT if timeout is None else timeout
+    
+    async def candidates(query: str) -> List[Dict[str, Any]]:
+        async with semaphore:
+            try:
+                # Each search checks out its own client; instances are not shared between threads
+                return await asyncio.wait_for(to_thread(search_candidates_pooled, query), timeout)
+            except asyncio.TimeoutError:
+                # The thread keeps running and returns its client to the pool when done
+                logging.warning(f"YouTube Music search timed out after {timeout:g}s: {query}")
+                return []
+    
+    try:
+        results = await to_thread(match_cache.get_many, songs)
+    except Exception as e:
+        logging.error(f"Error reading the match cache: {e}")
+        results = [None] * len(songs)
+    
+    pending = [i for i, found in enumerate(results) if found is None]
+    queries: Dict[str, str] = {}
+    for i in pending:
+        query = _song_query(songs[i])
+        queries.setdefault(normalize_query(query), query)
+    _count_deduplicated(len(pending) - len(queries))
+    
+    unique = list(queries)
+    searches = dict(zip(unique, await asyncio.gather(*(candidates(queries[key]) for key in unique))))
+    found_candidates = [searches[normalize_query(_song_query(songs[i]))] for i in pending]
+    searched = pick_best([songs[i] for i in pending], found_candidates)
+    for i, found in zip(pending, searched):
+        results[i] = found
+    
+    try:
+        await to_thread(match_cache.put_many, [(songs[i], found) for i, found in zip(pending, searched) if found])
+    except Exception as e:
+        logging.error(f"Error storing matches: {e}")
+    
+    return results
+
+async def sync_to_youtube_music_async(songs: List[Dict[str, Any]], parallelism: Optional[int] = None,
+                                      timeout: Optional[float] = None) -> Dict[str, Any]:
+    """Sync songs to YouTube Music (search and match), searching concurrently"""
+    try:
+        # Make sure at least one client can be built before fanning out
+        await to_thread(get_ytmusic_pool().warm, 1)
+    except Exception as e:
+        logging.error(f"Error setting up YTMusic: {e}")
         return {"success": False, "error": "Failed to setup YouTube Music client"}
     
+    results = await match_songs_async(songs, parallelism, timeout)
+    
     found_songs = []
     not_found = []
     
-    for song in songs:
-        # Create search query
-        artists = song.get('artists', [])
-        if isinstance(artists, str):
-            artists = [artists]
-        
-        query = create_search_query(
-            title=song.get('name', song.get('title', '')),
-            artists=artists,
-            album=song.get('album', '')
-        )
-        
-        # Search for the song
-        found_song = search_song(ytmusic, query)
+    for song, found_song in zip(songs, results):
         if found_song:
             found_songs.append({
                 'original': song,
@@ -142,3 +367,8 @@ def sync_to_youtube_music(songs: List[Dict[str, Any]]) -> Dict[str, Any]:
         "total_found": len(found_songs),
         "total_not_found": len(not_found)
     }
+
+def sync_to_youtube_music(songs: List[Dict[str, Any]], parallelism: Optional[int] = None,
+                          timeout: Optional[float] = None) -> Dict[str, Any]:
+    """Sync songs to YouTube Music (search and match)"""
+    return run_sync(sync_to_youtube_music_async(songs, parallelism, timeout))
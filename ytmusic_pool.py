@@ -0,0 +1,206 @@
+import os
+import time
+import logging
+import threading
+import requests
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from ytmusicapi import YTMusic
+
+# Defaults to the per-sync search concurrency so parallel searches never wait on the pool
+POOL_SIZE = int(os.getenv('YTMUSIC_POOL_SIZE', os.getenv('YTMUSIC_SEARCH_CONCURRENCY', '8')))
+# Per HTTP request; keep it below YTMUSIC_SEARCH_TIMEOUT so a search the
+# matcher gave up on also frees its thread and client soon after
+REQUEST_TIMEOUT = float(os.getenv('YTMUSIC_REQUEST_TIMEOUT', '10'))
+# Clients are rebuilt after this many uses or seconds, whichever comes first
+MAX_USES = int(os.getenv('YTMUSIC_CLIENT_MAX_USES', '1000'))
+MAX_AGE = float(os.getenv('YTMUSIC_CLIENT_MAX_AGE', '3600'))
+CHECKOUT_TIMEOUT = float(os.getenv('YTMUSIC_CHECKOUT_TIMEOUT', '30'))
+
+class _TimeoutSession(requests.Session):
+    """Session applying a configurable default timeout to every request.
+
+    ytmusicapi only sets a timeout (30s) on sessions it creates itself, and
+    leaves a caller-supplied session's requests without one.
+    """
+
+    def __init__(self, timeout: float):
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, *args: Any, **kwargs: Any) -> requests.Response:
+        kwargs.setdefault('timeout', self.timeout)
+        return super().request(*args, **kwargs)
+
+def build_client() -> YTMusic:
+    """Create a public-access YTMusic client whose requests time out"""
+    return YTMusic(requests_session=_TimeoutSession(REQUEST_TIMEOUT))
+
+class _PooledClient:
+    __slots__ = ('client', 'created', 'uses', 'failed')
+
+    def __init__(self, client: YTMusic):
+        self.client = client
+        self.created = time.monotonic()
+        self.uses = 0
+        self.failed = False
+
+class YTMusicPool:
+    """Process-wide pool of warmed YTMusic clients.
+
+    YTMusic instances are not safe to share between threads, so each caller
+    checks one out for exclusive use and returns it afterwards. Clients are
+    built lazily up to `size`; a caller that finds them all busy waits. A
+    client that raised during use, failed its health check, or has reached
+    max_uses or max_age is discarded instead of being returned to the pool.
+    Health checks run under the pool lock, so they should not touch the
+    network.
+    """
+
+    def __init__(self, size: int = POOL_SIZE, factory: Callable[[], YTMusic] = build_client,
+                 max_uses: int = MAX_USES, max_age: float = MAX_AGE,
+                 health_check: Optional[Callable[[YTMusic], bool]] = None):
+        self.size = size
+        self.factory = factory
+        self.max_uses = max_uses
+        self.max_age = max_age
+        self.health_check = health_check
+        self._idle: List[_PooledClient] = []
+        self._busy: Dict[int, _PooledClient] = {}
+        self._building = 0
+        self._cond = threading.Condition()
+        self._stats = {'created': 0, 'checkouts': 0, 'waits': 0, 'errors': 0, 'recycled': 0}
+
+    def _healthy(self, pooled: _PooledClient) -> bool:
+        if pooled.uses >= self.max_uses or time.monotonic() - pooled.created >= self.max_age:
+            return False
+        if self.health_check is not None:
+            try:
+                return self.health_check(pooled.client)
+            except Exception as e:
+                logging.warning(f"YTMusic client health check failed: {e}")
+                return False
+        return True
+
+    def _discard(self, pooled: _PooledClient) -> None:
+        session = getattr(pooled.client, '_session', None)
+        if session is not None:
+            try:
+                session.close()
+            except Exception:
+                pass
+
+    def warm(self, count: Optional[int] = None) -> None:
+        """Build idle clients ahead of the first requests"""
+        count = self.size if count is None else min(count, self.size)
+        while True:
+            with self._cond:
+                if len(self._idle) + len(self._busy) + self._building >= count:
+                    return
+            pooled = _PooledClient(self.factory())
+            with self._cond:
+                self._stats['created'] += 1
+                if len(self._idle) + len(self._busy) + self._building >= self.size:
+                    self._discard(pooled)
+                    return
+                self._idle.append(pooled)
+                self._cond.notify()
+
+    def checkout(self, timeout: float = CHECKOUT_TIMEOUT) -> YTMusic:
+        """Take a client for exclusive use, building one if the pool has room"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            waited = False
+            while True:
+                while self._idle:
+                    # Most recently returned first, so warm connections get reused
+                    pooled = self._idle.pop()
+                    if self._healthy(pooled):
+                        return self._lend(pooled, waited)
+                    self._stats['recycled'] += 1
+                    self._discard(pooled)
+                if len(self._busy) + self._building < self.size:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"No YTMusic client available after {timeout:.0f}s")
+                waited = True
+                self._cond.wait(remaining)
+            # Reserve the slot while the client is built outside the lock
+            self._building += 1
+
+        try:
+            pooled = _PooledClient(self.factory())
+        except BaseException:
+            with self._cond:
+                self._building -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._building -= 1
+            self._stats['created'] += 1
+            return self._lend(pooled, waited)
+
+    def _lend(self, pooled: _PooledClient, waited: bool) -> YTMusic:
+        pooled.uses += 1
+        self._busy[id(pooled.client)] = pooled
+        self._stats['checkouts'] += 1
+        if waited:
+            self._stats['waits'] += 1
+        return pooled.client
+
+    def checkin(self, client: YTMusic, failed: bool = False) -> None:
+        """Return a client; failed clients are discarded and rebuilt on demand"""
+        with self._cond:
+            pooled = self._busy.pop(id(client), None)
+            if pooled is None:
+                return
+            if failed or pooled.failed:
+                self._stats['errors'] += 1
+                self._discard(pooled)
+            else:
+                self._idle.append(pooled)
+            self._cond.notify()
+
+    def report_error(self, client: YTMusic) -> None:
+        """Mark a checked-out client as broken so checkin discards it.
+
+        For callers that handle a client's exception themselves instead of
+        letting it escape the with block.
+        """
+        with self._cond:
+            pooled = self._busy.get(id(client))
+            if pooled is not None:
+                pooled.failed = True
+
+    @contextmanager
+    def client(self, timeout: float = CHECKOUT_TIMEOUT) -> Iterator[YTMusic]:
+        """Check out a client for the duration of a with block"""
+        client = self.checkout(timeout)
+        failed = False
+        try:
+            yield client
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            self.checkin(client, failed)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._cond:
+            metrics: Dict[str, Any] = dict(self._stats)
+            metrics['idle'] = len(self._idle)
+            metrics['busy'] = len(self._busy)
+            return metrics
+
+_pool: Optional[YTMusicPool] = None
+_pool_lock = threading.Lock()
+
+def get_ytmusic_pool() -> YTMusicPool:
+    """Return the process-wide YTMusic client pool, creating it on first use"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = YTMusicPool()
+    return _pool